@@ -0,0 +1,82 @@
+"""Поля ресурсов API и их колонки в базе.
+
+Клиент выбирает поля параметром ?fields=, и запрос строится через
+values() только по нужным колонкам: без поля author не будет JOIN
+с таблицей пользователей.
+"""
+from django.core.files.storage import default_storage
+
+from .responses import ApiError
+
+
+def image_url(name):
+    return default_storage.url(name) if name else None
+
+
+class Resource:
+    """Публичное имя поля -> путь ORM и, если нужно, преобразование."""
+
+    def __init__(self, columns, converters=None):
+        self.columns = columns
+        self.converters = converters or {}
+
+    def pick(self, request):
+        raw = request.GET.get('fields')
+        if not raw:
+            return list(self.columns)
+        names = [name.strip() for name in raw.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.columns]
+        if unknown:
+            raise ApiError(
+                'Неизвестные поля: {}. Доступны: {}'.format(
+                    ', '.join(unknown), ', '.join(self.columns)
+                )
+            )
+        return names
+
+    def select(self, queryset, names, *extra):
+        """values() по колонкам полей names и служебным колонкам extra."""
+        columns = {self.columns[name] for name in names}
+        return queryset.values(*columns.union(extra))
+
+    def serialize(self, row, names):
+        item = {}
+        for name in names:
+            value = row[self.columns[name]]
+            convert = self.converters.get(name)
+            item[name] = convert(value) if convert else value
+        return item
+
+
+POST = Resource(
+    {
+        'id': 'pk',
+        'text': 'text',
+        'pub_date': 'pub_date',
+        'author': 'author__username',
+        'group': 'group__slug',
+        'image': 'image',
+        'image_width': 'image_width',
+        'image_height': 'image_height',
+        'comment_count': 'comment_count',
+    },
+    {'image': image_url},
+)
+
+COMMENT = Resource({
+    'id': 'pk',
+    'post': 'post_id',
+    'author': 'author__username',
+    'text': 'text',
+    'created': 'created',
+})
+
+FOLLOWER = Resource({
+    'id': 'user_id',
+    'username': 'user__username',
+})
+
+FOLLOWING = Resource({
+    'id': 'author_id',
+    'username': 'author__username',
+})
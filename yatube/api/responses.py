@@ -0,0 +1,52 @@
+"""Ответы API: ошибки в JSON и потоковая отдача страниц."""
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+
+
+class ApiError(Exception):
+    status = 400
+
+    def __init__(self, detail, status=None):
+        super().__init__(detail)
+        self.detail = detail
+        if status is not None:
+            self.status = status
+
+
+def api_view(view):
+    """Отвечает на ошибки JSON'ом, а не HTML-страницами сайта."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except Http404:
+            return JsonResponse({'detail': 'Не найдено'}, status=404)
+        except ApiError as error:
+            return JsonResponse({'detail': error.detail}, status=error.status)
+    return wrapper
+
+
+def dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def stream_page(page, resource, names):
+    """Отдаёт страницу курсорного паджинатора по одному объекту.
+
+    Курсоры известны до первой строки, поэтому идут в начале ответа,
+    а results сериализуются по мере отправки.
+    """
+    def chunks():
+        yield '{{"next": {}, "previous": {}, "results": ['.format(
+            dumps(page.next_cursor), dumps(page.previous_cursor)
+        )
+        for index, row in enumerate(page.object_list):
+            prefix = ',' if index else ''
+            yield prefix + dumps(resource.serialize(row, names))
+        yield ']}'
+    return StreamingHttpResponse(
+        chunks(), content_type='application/json; charset=utf-8'
+    )
@@ -0,0 +1,89 @@
+import json
+
+from django.test import Client, TestCase
+from django.urls import reverse
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {number}', author=cls.author, group=cls.group
+            )
+            for number in range(5)
+        ]
+        Comment.objects.create(
+            post=cls.posts[0], author=cls.reader, text='Комментарий'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def get_json(self, url, client=None, **params):
+        response = (client or self.client).get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_feed_walks_with_cursor(self):
+        """Курсоры next проходят ленту целиком без повторов."""
+        url = reverse('api:index')
+        data = self.get_json(url, limit=2)
+        ids = [item['id'] for item in data['results']]
+        while data['next']:
+            data = self.get_json(url, limit=2, cursor=data['next'])
+            ids += [item['id'] for item in data['results']]
+        self.assertEqual(ids, [post.id for post in reversed(self.posts)])
+
+    def test_fields_limit_columns(self):
+        """?fields= оставляет только выбранные поля и колонки."""
+        url = reverse('api:group', kwargs={'slug': 'group'})
+        with self.assertNumQueries(2) as queries:
+            data = self.get_json(url, fields='id,text')
+        self.assertEqual(set(data['results'][0]), {'id', 'text'})
+        self.assertNotIn('auth_user', queries.captured_queries[-1]['sql'])
+
+    def test_unknown_field_is_bad_request(self):
+        response = self.client.get(reverse('api:index'), {'fields': 'secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.json()['detail'])
+
+    def test_post_and_comments(self):
+        post = self.posts[0]
+        data = self.client.get(
+            reverse('api:post', kwargs={'post_id': post.id})
+        ).json()
+        self.assertEqual(data['author'], 'Author')
+        self.assertEqual(data['comment_count'], 1)
+        comments = self.get_json(
+            reverse('api:comments', kwargs={'post_id': post.id})
+        )
+        self.assertEqual(comments['results'][0]['text'], 'Комментарий')
+
+    def test_missing_objects_are_json_404(self):
+        response = self.client.get(
+            reverse('api:profile', kwargs={'username': 'Nobody'})
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_follow_graph(self):
+        followers = self.get_json(
+            reverse('api:followers', kwargs={'username': 'Author'})
+        )
+        following = self.get_json(
+            reverse('api:following', kwargs={'username': 'Reader'})
+        )
+        self.assertEqual(followers['results'][0]['username'], 'Reader')
+        self.assertEqual(following['results'][0]['username'], 'Author')
+
+    def test_follow_feed_requires_login(self):
+        url = reverse('api:follow_index')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        client = Client()
+        client.force_login(self.reader)
+        data = self.get_json(url, client)
+        self.assertEqual(len(data['results']), len(self.posts))
@@ -0,0 +1,25 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'api'
+
+urlpatterns = [
+    path('posts/', views.index, name='index'),
+    path('posts/<int:post_id>/', views.post_detail, name='post'),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.comments,
+        name='comments'),
+    path('groups/<slug:slug>/posts/', views.group_posts, name='group'),
+    path('follow/posts/', views.follow_index, name='follow_index'),
+    path('users/<str:username>/posts/', views.profile, name='profile'),
+    path(
+        'users/<str:username>/followers/',
+        views.followers,
+        name='followers'),
+    path(
+        'users/<str:username>/following/',
+        views.following,
+        name='following'),
+]
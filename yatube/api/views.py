@@ -0,0 +1,122 @@
+"""Версия 1 JSON API: ленты, посты с комментариями и подписки.
+
+Все списки курсорные, как ленты сайта: ?cursor= из next/previous
+предыдущего ответа, ?limit= — размер страницы, ?fields= — поля объекта.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
+
+from posts import timeline
+from posts.models import Comment, Follow, Group, Post, User
+from posts.paginators import CursorPaginator
+
+from . import fields
+from .responses import ApiError, api_view, stream_page
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('limit', settings.API_PAGE_SIZE))
+    except ValueError:
+        raise ApiError('limit должен быть числом')
+    if not 1 <= size <= settings.API_MAX_PAGE_SIZE:
+        raise ApiError(f'limit от 1 до {settings.API_MAX_PAGE_SIZE}')
+    return size
+
+
+def paginated(request, queryset, resource, key='pub_date',
+              paginator_class=CursorPaginator):
+    names = resource.pick(request)
+    rows = resource.select(queryset, names, 'pk', key)
+    paginator = paginator_class(rows, page_size(request), key=key)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return stream_page(page, resource, names)
+
+
+@require_GET
+@api_view
+def index(request):
+    return paginated(request, Post.objects.all(), fields.POST)
+
+
+@require_GET
+@api_view
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return paginated(request, group.posts.all(), fields.POST)
+
+
+@require_GET
+@api_view
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return paginated(request, author.posts.all(), fields.POST)
+
+
+@require_GET
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Нужно войти на сайт', status=401)
+    return paginated(
+        request, Post.objects.all(), fields.POST,
+        paginator_class=partial(
+            timeline.TimelinePaginator, user=request.user
+        )
+    )
+
+
+@require_GET
+@api_view
+def post_detail(request, post_id):
+    names = fields.POST.pick(request)
+    row = fields.POST.select(
+        Post.objects.filter(pk=post_id), names, 'pk'
+    ).first()
+    if row is None:
+        raise Http404
+    return JsonResponse(
+        fields.POST.serialize(row, names),
+        json_dumps_params={'ensure_ascii': False}
+    )
+
+
+@require_GET
+@api_view
+def comments(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    return paginated(
+        request,
+        Comment.objects.filter(post_id=post_id),
+        fields.COMMENT,
+        key='created'
+    )
+
+
+@require_GET
+@api_view
+def followers(request, username):
+    author = get_object_or_404(User, username=username)
+    return paginated(
+        request,
+        Follow.objects.filter(author=author),
+        fields.FOLLOWER,
+        key='pk'
+    )
+
+
+@require_GET
+@api_view
+def following(request, username):
+    user = get_object_or_404(User, username=username)
+    return paginated(
+        request,
+        Follow.objects.filter(user=user),
+        fields.FOLLOWING,
+        key='pk'
+    )
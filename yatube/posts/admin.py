@@ -1,11 +1,31 @@
+from django.conf import settings
 from django.contrib import admin
 
-from .models import Comment, Follow, Group, Post
+from .models import Comment, Follow, Group, Post, UserStats
+from .search import get_backend
 
 
-class PostAdmin(admin.ModelAdmin):
+class IndexedSearchMixin:
+    """Поиск в админке через полнотекстовый индекс вместо LIKE."""
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        hits = get_backend().search(
+            search_term, settings.ADMIN_SEARCH_LIMIT, kind=self.search_kind
+        )
+        if self.search_kind == 'comment':
+            ids = [hit.comment_id for hit in hits]
+        else:
+            ids = [hit.post_id for hit in hits]
+        return queryset.filter(pk__in=ids), False
+
+
+class PostAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group')
     search_fields = ('text',)
+    search_kind = 'post'
     list_filter = ('pub_date', 'group',)
     empty_value_display = '-пусто-'
 
@@ -17,9 +37,10 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('pk', 'text', 'post', 'author', 'created')
     search_fields = ('text',)
+    search_kind = 'comment'
     list_filter = ('created', 'author',)
     empty_value_display = '-пусто-'
 
@@ -31,7 +52,17 @@ class FollowAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'user', 'posts_count', 'followers_count', 'follows_count'
+    )
+    readonly_fields = ('posts_count', 'followers_count', 'follows_count')
+    search_fields = ('user__username',)
+    empty_value_display = '-пусто-'
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(UserStats, UserStatsAdmin)
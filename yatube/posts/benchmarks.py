@@ -0,0 +1,269 @@
+"""Замеры view на синтетических базах разного размера.
+
+Каждый маршрут posts.urls, users.urls и about.urls открывается тестовым
+клиентом repeat раз подряд: первый запрос идёт в пустой кэш, остальные —
+как у живого сайта с прогретым кэшем, поэтому p99 показывает холодный
+запрос, а p50 — обычный. Число запросов и строк снимается с последнего
+(тёплого) прогона, пиковая память — отдельным прогоном под tracemalloc, чтобы
+он не искажал время.
+"""
+import gc
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from importlib import import_module
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.test import Client
+from django.urls import URLPattern, reverse
+
+from .models import Group, Post, User, UserStats
+from .sitemaps import segment_number
+from .synthetic import WORDS
+
+SIZES = {
+    'small': 1000,
+    'medium': 10000,
+    'large': 100000,
+}
+
+URLCONFS = [
+    ('posts.urls', ''),
+    ('users.urls', ''),
+    ('about.urls', 'about:'),
+]
+
+# /404/ и /500/ перехватывает профиль пользователя.
+UNREACHABLE = ('page_not_found', 'server_error')
+
+QUERY_STRINGS = {
+    'search': f'q={WORDS[0]}',
+}
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries', 'rows', 'peak_kb')
+
+
+class DatabaseProbe:
+    """Считает запросы и строки, которые view достаёт из базы.
+
+    CaptureQueriesContext здесь не годится: журнал запросов очищается
+    сигналом request_started. SQLite не сообщает число строк SELECT,
+    поэтому на время замера подменяются методы fetch* обёртки курсора.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def counting(self):
+        self.queries = self.rows = 0
+        counter = self
+
+        def fetchone(wrapper):
+            row = wrapper.cursor.fetchone()
+            counter.rows += row is not None
+            return row
+
+        def fetchmany(wrapper, *args):
+            rows = wrapper.cursor.fetchmany(*args)
+            counter.rows += len(rows)
+            return rows
+
+        def fetchall(wrapper):
+            rows = wrapper.cursor.fetchall()
+            counter.rows += len(rows)
+            return rows
+
+        patched = {
+            'fetchone': fetchone,
+            'fetchmany': fetchmany,
+            'fetchall': fetchall,
+        }
+        for name, method in patched.items():
+            setattr(CursorWrapper, name, method)
+        try:
+            with connection.execute_wrapper(self):
+                yield self
+        finally:
+            for name in patched:
+                delattr(CursorWrapper, name)
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(share * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def sample_kwargs():
+    """Значения параметров маршрутов из сгенерированных данных."""
+    author = UserStats.objects.order_by('-followers_count').values_list(
+        'user__username', flat=True
+    )[1]
+    post = Post.objects.filter(author__username=author).latest('pub_date')
+    return {
+        'username': author,
+        'post_id': post.pk,
+        'slug': Group.objects.values_list('slug', flat=True).first(),
+        'feed_format': 'atom',
+        'number': segment_number(post.pk),
+    }
+
+
+def routes():
+    """Пары (имя маршрута, URL) всех измеряемых маршрутов."""
+    kwargs = sample_kwargs()
+    for urlconf, namespace in URLCONFS:
+        for pattern in import_module(urlconf).urlpatterns:
+            if not isinstance(pattern, URLPattern):
+                continue
+            if pattern.name in UNREACHABLE:
+                continue
+            url = reverse(namespace + pattern.name, kwargs={
+                name: kwargs[name] for name in pattern.pattern.converters
+            })
+            query = QUERY_STRINGS.get(pattern.name)
+            if query:
+                url = f'{url}?{query}'
+            yield namespace + pattern.name, url
+
+
+def isolated_caches(directory):
+    """CACHES с теми же бэкендами, но в своих хранилищах.
+
+    Файлы SQLiteCache переезжают в directory, у TieredCache свой LRU
+    процесса. Внешние кэши (memcached, redis) общие с сайтом, поэтому
+    их заменяет кэш в памяти.
+    """
+    caches = {}
+    for alias, params in settings.CACHES.items():
+        params = dict(params)
+        if params['BACKEND'] == 'yatube.cache.SQLiteCache':
+            params['LOCATION'] = os.path.join(
+                directory, os.path.basename(params['LOCATION'])
+            )
+        elif params['BACKEND'] == 'yatube.cache.TieredCache':
+            params['LOCATION'] = f'benchmark:{params.get("LOCATION", "")}'
+        else:
+            params = {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'benchmark:{alias}',
+            }
+        caches[alias] = params
+    return caches
+
+
+def viewer():
+    """Самый активный пользователь: у него есть и посты, и подписки."""
+    return User.objects.order_by('-stats__follows_count').first()
+
+
+def fetch(client, url):
+    response = client.get(url)
+    # Ленты отдаются потоком и строятся, пока читается тело.
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def measure(client, user, url, repeat):
+    cache.clear()
+    timings = []
+    probe = DatabaseProbe()
+    for _ in range(repeat):
+        # Маршруты вроде logout разлогинивают клиента.
+        client.force_login(user)
+        # Сборщик мусора выключен на время запроса, как в timeit:
+        # иначе паузы от чужих объектов попадают в хвосты.
+        gc.collect()
+        gc.disable()
+        try:
+            with probe.counting():
+                started = time.perf_counter()
+                fetch(client, url)
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            gc.enable()
+    client.force_login(user)
+    tracemalloc.start()
+    try:
+        fetch(client, url)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'queries': probe.queries,
+        'rows': probe.rows,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(repeat):
+    client = Client()
+    user = viewer()
+    return {
+        name: measure(client, user, url, repeat) for name, url in routes()
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Строки отчёта и список маршрутов, ставших хуже baseline.
+
+    Время и память сравниваются с допуском threshold, а время ещё и
+    с абсолютным min_delta_ms: на миллисекундных view доли шумят.
+    Число запросов и строк сравнивается точно: их рост не бывает шумом.
+    """
+    lines, regressions = [], []
+    for name, metrics in results.items():
+        old = baseline.get(name)
+        if old is None:
+            lines.append(f'{name}: нет в baseline')
+            continue
+        for metric in METRICS:
+            before, after = old.get(metric), metrics[metric]
+            if before is None:
+                continue
+            allowed = before if metric in ('queries', 'rows') else (
+                before * (1 + threshold)
+            )
+            worse = after > allowed
+            if metric.endswith('_ms') and after - before < min_delta_ms:
+                worse = False
+            if worse:
+                regressions.append(f'{name}.{metric}')
+            change = (after - before) / before * 100 if before else 0
+            lines.append('{}{} {}: {} -> {} ({:+.0f}%)'.format(
+                '! ' if worse else '  ', name, metric, before, after, change
+            ))
+    return lines, regressions
+
+
+def baseline_path(directory, size):
+    return os.path.join(directory, f'{size}.json')
+
+
+def load_baseline(directory, size):
+    with open(baseline_path(directory, size), encoding='utf-8') as stream:
+        return json.load(stream)
+
+
+def save_baseline(directory, size, document):
+    os.makedirs(directory, exist_ok=True)
+    path = baseline_path(directory, size)
+    with open(path, 'w', encoding='utf-8') as stream:
+        json.dump(document, stream, ensure_ascii=False, indent=2,
+                  sort_keys=True)
+        stream.write('\n')
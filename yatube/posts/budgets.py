@@ -0,0 +1,17 @@
+"""Бюджеты SQL-запросов для view.
+
+Бюджет не зависит от числа постов на странице: если шаблон начинает
+ходить в базу за каждым постом, тест posts.tests.test_queries падает.
+В бюджет входят запросы сессии и пользователя авторизованного клиента.
+"""
+
+QUERY_BUDGETS = {}
+
+
+def query_budget(limit):
+    """Объявляет, сколько SQL-запросов может выполнить view."""
+    def decorator(view):
+        view.query_budget = limit
+        QUERY_BUDGETS[f'{view.__module__}.{view.__name__}'] = limit
+        return view
+    return decorator
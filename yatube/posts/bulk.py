@@ -0,0 +1,40 @@
+"""Общее для массовой записи в обход сигналов: импорта и генератора данных.
+
+bulk_create не отправляет сигналы, поэтому счётчики, ленты подписок и
+индекс поиска после такой записи строятся заново целиком.
+"""
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.management import call_command
+
+from . import sitemaps
+from .models import Comment, Post
+
+
+@contextmanager
+def original_dates():
+    """Даёт bulk_create записать pub_date и created из данных.
+
+    Иначе auto_now_add подставит вместо них время записи.
+    """
+    fields = [
+        Post._meta.get_field('pub_date'),
+        Comment._meta.get_field('created'),
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def rebuild_derived(stdout):
+    """Пересчитывает всё, что при обычной записи поддерживают сигналы."""
+    call_command('recount_counters', stdout=stdout)
+    call_command('rebuild_timelines', stdout=stdout)
+    call_command('search_index', stdout=stdout)
+    sitemaps.reset()
+    cache.clear()
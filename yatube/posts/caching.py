@@ -0,0 +1,249 @@
+"""Кэш страниц с поколениями вместо короткого таймаута.
+
+У каждой области кэша (лента, группа, профиль) есть номер поколения,
+который входит в ключ страницы. Запись, меняющая страницу, увеличивает
+номер — и все старые страницы области перестают находиться, поэтому
+страницы можно хранить часами и при этом не отдавать устаревшие.
+Имена областей экранируются: ключи кэша должны быть ASCII без пробелов.
+"""
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.vary import vary_on_cookie
+
+from .coalescing import coalesce, page_key
+from .models import Follow, Post
+from .routers import cache_timeout, current_replica
+
+
+def index_scope():
+    return 'index'
+
+
+def group_scope(slug):
+    return f'group:{quote(slug)}'
+
+
+def profile_scope(username):
+    return f'profile:{quote(username)}'
+
+
+def post_scopes(post):
+    """Области кэша страниц, на которых видна карточка поста."""
+    return [
+        index_scope(),
+        profile_scope(post.author.username),
+        post.group and group_scope(post.group.slug),
+    ]
+
+
+def generation_key(scope):
+    return f'generation:{scope}'
+
+
+def get_generation(scope, create=True):
+    """Номер поколения области; без create отсутствующий не заводится.
+
+    Номер заводят только области, чья страница нашлась: иначе каждый
+    адрес несуществующей группы или автора оставлял бы запись в кэше.
+    """
+    key = generation_key(scope)
+    generation = cache.get(key)
+    if generation is None and create:
+        # Начинаем с текущего времени, а не с единицы: если номер истечёт
+        # или его вытеснят, он не вернётся к значению, под которым лежат
+        # старые страницы.
+        cache.add(key, time.time_ns(), settings.GENERATION_TIMEOUT)
+        generation = cache.get(key)
+    return generation
+
+
+def incr_generations(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(generation_key(scope))
+        except ValueError:
+            # Запись меняет существующие группу и автора: их номер
+            # заводить можно.
+            cache.add(
+                generation_key(scope), time.time_ns(),
+                settings.GENERATION_TIMEOUT
+            )
+
+
+def bump_generations(*scopes):
+    """Сбрасывает страницы областей scopes.
+
+    Внутри транзакции номер растёт сразу, чтобы изменения были видны
+    в ней самой, и ещё раз после commit, чтобы выбросить страницы,
+    собранные другими запросами до фиксации записи.
+    """
+    scopes = list(dict.fromkeys(scope for scope in scopes if scope))
+    if transaction.get_connection().in_atomic_block:
+        incr_generations(scopes)
+    transaction.on_commit(lambda: incr_generations(scopes))
+
+
+def cache_generational(*scope_funcs):
+    """Кэширует view в ключе текущих поколений его областей.
+
+    scope_funcs получают именованные аргументы view и возвращают имя
+    области — как group_scope(slug) для group_posts(request, slug).
+    Устаревшую страницу пересобирает один запрос (posts.coalescing).
+    Пока у области нет номера, страница не кэшируется, а номер заводит
+    ответ 200: адрес, отдавший 404, следа в кэше не оставляет.
+    """
+    def decorator(view):
+        # Vary: Cookie ставит и SessionMiddleware, но уже после того,
+        # как страница попадёт в кэш.
+        varied = vary_on_cookie(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return varied(request, *args, **kwargs)
+            scopes = [func(**kwargs) for func in scope_funcs]
+            generations = [
+                get_generation(scope, create=False) for scope in scopes
+            ]
+            if None in generations:
+                response = varied(request, *args, **kwargs)
+                if response.status_code == 200:
+                    for scope in scopes:
+                        get_generation(scope)
+                return response
+            generation = '.'.join(
+                f'{scope}@{number}'
+                for scope, number in zip(scopes, generations)
+            )
+            # Cookie входит в ключ: страница пользователя не должна
+            # достаться остальным.
+            key = page_key(
+                request.get_full_path(), request.META.get('HTTP_COOKIE', '')
+            )
+            return coalesce(
+                key, generation,
+                lambda: varied(request, *args, **kwargs),
+                cache_timeout(settings.PAGE_CACHE_TIMEOUT)
+            )
+        return wrapper
+    return decorator
+
+
+def generation_etag(*scope_funcs):
+    """etag_func для condition() по поколениям областей страницы.
+
+    Поколение меняется при каждой записи, видимой на странице, поэтому
+    свежесть копии клиента проверяется без запросов к базе. В метку
+    входит пользователь: шапка и кнопки у каждого свои.
+
+    Страница с отстающей реплики может не содержать записей текущего
+    поколения, поэтому при чтении с реплики метки нет: иначе её 304
+    закрепил бы у клиента устаревшую копию до следующей записи.
+    """
+    def etag(request, *args, **kwargs):
+        if current_replica() is not None:
+            return None
+        generations = [
+            get_generation(func(**kwargs), create=False)
+            for func in scope_funcs
+        ]
+        if None in generations:
+            return None
+        return '.'.join(map(str, (request.user.pk, *generations)))
+    return etag
+
+
+def post_etag(request, username, post_id):
+    """etag_func страницы поста: одна строка по первичному ключу.
+
+    version растёт при правке поста и его комментариях, счётчики автора
+    показываются в карточке профиля рядом с постом. Токен CSRF меняется
+    при входе, поэтому в метку входит хэш его cookie: иначе 304 оставил бы
+    у клиента форму со старым токеном.
+    """
+    # Строка одна, поэтому без ORDER BY: first() отсортировал бы её
+    # во временном дереве.
+    rows = Post.objects.filter(
+        pk=post_id, author__username=username
+    ).order_by().values_list(
+        'version',
+        'author__stats__posts_count',
+        'author__stats__followers_count',
+        'author__stats__follows_count',
+    )[:1]
+    if not rows:
+        return None
+    csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return '.'.join(str(value) for value in (
+        request.user.pk, *rows[0], hashlib.md5(csrf.encode()).hexdigest()
+    ))
+
+
+def author_stamp_key(author_id):
+    return f'stamp:author:{author_id}'
+
+
+def follower_stamp_key(user_id):
+    return f'stamp:follower:{user_id}'
+
+
+def set_stamps(keys):
+    cache.set_many({key: time.time_ns() for key in keys}, None)
+
+
+def touch_stamps(*keys):
+    """Меняет метки сразу и после commit, как bump_generations."""
+    if transaction.get_connection().in_atomic_block:
+        set_stamps(keys)
+    transaction.on_commit(lambda: set_stamps(keys))
+
+
+def read_stamps(keys):
+    found = cache.get_many(keys)
+    return [found.get(key) for key in keys]
+
+
+def cache_follow_feed(view):
+    """Кэширует ленту подписок отдельно для каждого пользователя.
+
+    Вместе со страницей хранятся метки пользователя и всех его авторов
+    на момент сборки. При чтении метки сверяются одним get_many: новый
+    пост автора меняет только его метку и не трогает ключи подписчиков.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user_id = request.user.pk
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        key = f'follow_feed:{user_id}:{path}'
+        entry = cache.get(key)
+        if entry is not None:
+            stamp_keys = [follower_stamp_key(user_id)] + [
+                author_stamp_key(author_id) for author_id in entry['authors']
+            ]
+            if read_stamps(stamp_keys) == entry['stamps']:
+                return entry['response']
+        authors = list(Follow.objects.filter(user_id=user_id).values_list(
+            'author_id', flat=True
+        ))
+        stamp_keys = [follower_stamp_key(user_id)] + [
+            author_stamp_key(author_id) for author_id in authors
+        ]
+        # Метки читаются до сборки страницы: запись, попавшая между
+        # чтением и сохранением, сменит метку, и страница не пройдёт
+        # сверку.
+        stamps = read_stamps(stamp_keys)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, {
+                'authors': authors,
+                'stamps': stamps,
+                'response': response,
+            }, cache_timeout(settings.FOLLOW_FEED_CACHE_TIMEOUT))
+        return response
+    return wrapper
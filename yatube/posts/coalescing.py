@@ -0,0 +1,122 @@
+"""Защита кэша страниц от набега при пересборке.
+
+Когда страница устаревает (истёк срок или сменилось поколение), её
+пересобирает только один запрос — тот, кто взял блокировку в кэше.
+Остальные в это время получают прежнюю копию, если у неё лишь истёк
+срок. Копию прежнего поколения не отдают: в ней может не быть только
+что опубликованного поста, поэтому без подходящей копии ждут до
+COALESCE_WAIT секунд, пока сборщик положит новую, а потом собирают сами.
+Свежая копия пересобирается заранее с вероятностью, которая растёт
+к концу срока и со временем сборки (XFetch), поэтому записи редко
+истекают под нагрузкой.
+
+Счётчики процесса показывает /admin/request-stats/: rebuilds_avoided —
+сколько запросов обошлись без своей сборки.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+METRICS = (
+    'hits', 'rebuilds', 'early_rebuilds', 'stale_served', 'waited',
+    'wait_timeouts',
+)
+
+_metrics = Counter()
+_lock = threading.Lock()
+
+
+def count(name):
+    with _lock:
+        _metrics[name] += 1
+
+
+def metrics():
+    with _lock:
+        snapshot = {name: _metrics[name] for name in METRICS}
+    snapshot['rebuilds_avoided'] = (
+        snapshot['stale_served'] + snapshot['waited']
+    )
+    return snapshot
+
+
+def page_key(path, cookie):
+    """Ключ страницы; Cookie в нём, как у vary_on_cookie."""
+    path = hashlib.md5(path.encode()).hexdigest()
+    cookie = hashlib.md5(cookie.encode()).hexdigest()
+    return f'page:{path}:{cookie}'
+
+
+def is_fresh(entry, generation):
+    if entry['generation'] != generation:
+        return False
+    # Экспоненциальная добавка к текущему времени: чем дольше сборка,
+    # тем раньше до срока её кто-то начнёт.
+    early = entry['delta'] * settings.COALESCE_BETA * -math.log(
+        1 - random.random()
+    )
+    return time.time() + early < entry['expires']
+
+
+def rebuild(key, generation, build, timeout):
+    started = time.perf_counter()
+    response = build()
+    delta = time.perf_counter() - started
+    if response.status_code == 200 and not response.streaming:
+        # Запись живёт дольше своего срока: устаревшую копию отдают,
+        # пока идёт пересборка.
+        cache.set(key, {
+            'generation': generation,
+            'response': response,
+            'delta': delta,
+            'expires': time.time() + timeout,
+        }, timeout + settings.COALESCE_STALE)
+    return response
+
+
+def wait(key, generation):
+    deadline = time.monotonic() + settings.COALESCE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(settings.COALESCE_POLL)
+        entry = cache.get(key)
+        if entry is not None and entry['generation'] == generation:
+            return entry['response']
+    return None
+
+
+def coalesce(key, generation, build, timeout):
+    """Ответ из кэша по key для поколения generation или от build().
+
+    build вызывает не больше одного запроса на ключ одновременно.
+    """
+    entry = cache.get(key)
+    if entry is not None and is_fresh(entry, generation):
+        count('hits')
+        return entry['response']
+    lock_key = f'{key}:rebuild'
+    if cache.add(lock_key, 1, settings.COALESCE_LOCK_TIMEOUT):
+        early = (
+            entry is not None and entry['generation'] == generation
+            and entry['expires'] > time.time()
+        )
+        count('early_rebuilds' if early else 'rebuilds')
+        try:
+            return rebuild(key, generation, build, timeout)
+        finally:
+            cache.delete(lock_key)
+    if entry is not None and entry['generation'] == generation:
+        count('stale_served')
+        return entry['response']
+    response = wait(key, generation)
+    if response is not None:
+        count('waited')
+        return response
+    # Сборщик не успел: собираем сами, не дожидаясь его блокировки.
+    count('wait_timeouts')
+    return rebuild(key, generation, build, timeout)
@@ -0,0 +1,246 @@
+"""Atom и RSS ленты сайта, сообщества и автора.
+
+Лента — последние FEED_SIZE постов одним запросом по тому же индексу,
+что и страница. Готовый XML лежит в кэше под поколением области
+страницы (posts.caching), поэтому его сбрасывают те же записи, что
+и саму страницу, а ETag проверяется без запросов к базе. Ответ
+отдаётся по частям, пока строится, и кладётся в кэш, только если
+клиент дочитал его до конца.
+"""
+import hashlib
+from io import StringIO
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import feedgenerator
+from django.utils.text import Truncator
+from django.utils.xmlutils import SimplerXMLGenerator
+from django.views.decorators.http import condition
+
+from .budgets import query_budget
+from .caching import get_generation, group_scope, index_scope, profile_scope
+from .models import Group, Post, User
+from .routers import cache_timeout, current_replica
+
+
+class StreamingMixin:
+    """Пишет ленту частями: заголовок и затем по одному посту.
+
+    Посты не копятся в items: дата обновления ленты в заголовке
+    берётся из первого поста, они идут от новых к старым.
+    """
+    updated = None
+
+    def latest_post_date(self):
+        return self.updated or super().latest_post_date()
+
+    def stream(self, items, encoding='utf-8'):
+        items = iter(items)
+        first = next(items, None)
+        if first is not None:
+            self.updated = first['pubdate']
+            items = chain([first], items)
+        buffer = StringIO()
+        handler = SimplerXMLGenerator(buffer, encoding)
+
+        def flush():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        handler.startDocument()
+        self.open_document(handler)
+        self.add_root_elements(handler)
+        yield flush()
+        for item in items:
+            self.write_item(handler, item)
+            yield flush()
+        self.close_document(handler)
+        yield flush()
+
+
+class AtomFeed(StreamingMixin, feedgenerator.Atom1Feed):
+    def open_document(self, handler):
+        handler.startElement('feed', self.root_attributes())
+
+    def write_item(self, handler, item):
+        handler.startElement('entry', self.item_attributes(item))
+        self.add_item_elements(handler, item)
+        handler.endElement('entry')
+
+    def close_document(self, handler):
+        handler.endElement('feed')
+
+
+class RssFeed(StreamingMixin, feedgenerator.Rss201rev2Feed):
+    def open_document(self, handler):
+        handler.startElement('rss', self.rss_attributes())
+        handler.startElement('channel', self.root_attributes())
+
+    def write_item(self, handler, item):
+        handler.startElement('item', self.item_attributes(item))
+        self.add_item_elements(handler, item)
+        handler.endElement('item')
+
+    def close_document(self, handler):
+        self.endChannelElement(handler)
+        handler.endElement('rss')
+
+
+FORMATS = {'atom': AtomFeed, 'rss': RssFeed}
+
+
+class FeedFormatConverter:
+    regex = '|'.join(FORMATS)
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return value
+
+
+def feed_item(request, post):
+    link = request.build_absolute_uri(
+        reverse('post', args=[post.author.username, post.id])
+    )
+    return {
+        'title': Truncator(post.text).words(10),
+        'link': link,
+        'description': post.text,
+        'author_name': post.author.get_full_name() or post.author.username,
+        'author_link': request.build_absolute_uri(
+            reverse('profile', args=[post.author.username])
+        ),
+        'pubdate': post.pub_date,
+        'updateddate': None,
+        'comments': None,
+        'unique_id': link,
+        'unique_id_is_permalink': True,
+        'enclosures': (),
+        'categories': [post.group.title] if post.group else (),
+        'author_email': None,
+        'item_copyright': None,
+        'ttl': None,
+    }
+
+
+def feed_items(request, post_list):
+    """Посты ленты по мере чтения из базы."""
+    post_list = post_list.select_related('author', 'group').order_by(
+        '-pub_date', '-id'
+    )[:settings.FEED_SIZE]
+    return (feed_item(request, post) for post in post_list.iterator())
+
+
+def stored(key, chunks, timeout):
+    """Отдаёт части дальше и кладёт ленту в кэш после последней."""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(parts), timeout)
+
+
+def feed_key(request, feed_format, scope, generation):
+    # Ссылки в ленте абсолютные, поэтому хост входит в ключ.
+    host = hashlib.md5(request.get_host().encode()).hexdigest()
+    return f'feed:{feed_format}:{host}:{scope}@{generation}'
+
+
+def feed_etag(scope_func):
+    """etag_func ленты: одна на всех пользователей, меняется с поколением.
+
+    Как и у страниц, при чтении с реплики метки нет (см. generation_etag).
+    """
+    def etag(request, feed_format, **kwargs):
+        if current_replica() is not None:
+            return None
+        generation = get_generation(scope_func(**kwargs), create=False)
+        if generation is None:
+            return None
+        return f'{feed_format}.{generation}'
+    return etag
+
+
+def feed_response(request, feed_format, scope, build):
+    """Лента из кэша или построенная build() с записью в кэш.
+
+    build возвращает заголовок ленты и генератор её постов, а если
+    группы или автора нет — поднимает Http404. Номер поколения
+    заводится только после build(), как в cache_generational.
+    """
+    feed_class = FORMATS[feed_format]
+    generation = get_generation(scope, create=False)
+    content = None
+    if generation is not None:
+        content = cache.get(
+            feed_key(request, feed_format, scope, generation)
+        )
+    if content is not None:
+        chunks = [content]
+    else:
+        (title, link, description), items = build()
+        key = feed_key(
+            request, feed_format, scope, generation or get_generation(scope)
+        )
+        feed = feed_class(
+            title=title,
+            link=request.build_absolute_uri(link),
+            description=description,
+            language=settings.LANGUAGE_CODE,
+            feed_url=request.build_absolute_uri(),
+        )
+        chunks = stored(
+            key, feed.stream(items),
+            cache_timeout(settings.PAGE_CACHE_TIMEOUT)
+        )
+    return StreamingHttpResponse(
+        chunks, content_type=feed_class.content_type
+    )
+
+
+@query_budget(2)
+@condition(etag_func=feed_etag(index_scope))
+def site_feed(request, feed_format):
+    def build():
+        header = (
+            'Yatube', reverse('index'), 'Последние записи Yatube'
+        )
+        return header, feed_items(request, Post.objects.all())
+    return feed_response(request, feed_format, index_scope(), build)
+
+
+@query_budget(3)
+@condition(etag_func=feed_etag(group_scope))
+def group_feed(request, feed_format, slug):
+    def build():
+        group = get_object_or_404(Group, slug=slug)
+        header = (
+            f'{group.title} | Yatube',
+            reverse('group', args=[slug]),
+            group.description,
+        )
+        return header, feed_items(request, group.posts.all())
+    return feed_response(request, feed_format, group_scope(slug), build)
+
+
+@query_budget(3)
+@condition(etag_func=feed_etag(profile_scope))
+def author_feed(request, feed_format, username):
+    def build():
+        author = get_object_or_404(User, username=username)
+        header = (
+            f'{author.get_full_name() or username} | Yatube',
+            reverse('profile', args=[username]),
+            f'Записи пользователя {username}',
+        )
+        return header, feed_items(request, author.posts.all())
+    return feed_response(
+        request, feed_format, profile_scope(username), build
+    )
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import normalize_upload
 from .models import Comment, Post
 
 
@@ -14,6 +16,17 @@ class PostForm(forms.ModelForm):
             raise forms.ValidationError('Напишите текст')
         return data
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if image is False:
+            self.instance.image_width = self.instance.image_height = None
+        if not isinstance(image, UploadedFile):
+            return image
+        image, width, height = normalize_upload(image)
+        self.instance.image_width = width
+        self.instance.image_height = height
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,78 @@
+"""Нормализация картинок при загрузке.
+
+Загрузки больше FILE_UPLOAD_MAX_MEMORY_SIZE Django пишет во временный
+файл, а PIL при открытии читает только заголовок — поэтому лимиты на
+размер файла и число пикселей проверяются до декодирования. Картинку
+поворачиваем по EXIF, убираем EXIF и уменьшаем до POST_IMAGE_MAX_SIDE
+(от анимации и MPO остаётся первый кадр), чтобы миниатюры и страницы
+потом не разбирали многомегабайтные исходники.
+"""
+import tempfile
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+EXIF_ORIENTATION = 0x0112
+
+
+def normalize_upload(upload):
+    """Возвращает (файл, ширина, высота) для сохранения в Post.image.
+
+    Картинка, которой нечего менять, возвращается как есть, без
+    перекодирования и потери качества.
+    """
+    if upload.size > settings.POST_IMAGE_MAX_BYTES:
+        raise forms.ValidationError(
+            'Файл больше %s' % filesizeformat(settings.POST_IMAGE_MAX_BYTES)
+        )
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise forms.ValidationError(
+            f'Картинка {width}×{height} слишком большая, '
+            f'допустимо до {settings.POST_IMAGE_MAX_PIXELS} пикселей'
+        )
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+    # Анимацию и MPO пришлось бы пересобирать покадрово, а метаданные
+    # бывают в любом кадре: сохраняем только первый кадр.
+    multiframe = (
+        getattr(image, 'is_animated', False) or image.format == 'MPO'
+    )
+    needs_work = (
+        max(width, height) > max_side or rotated or 'exif' in image.info
+        or multiframe
+    )
+    if not needs_work:
+        upload.seek(0)
+        return upload, width, height
+
+    # Первый кадр MPO — обычный JPEG.
+    image_format = 'JPEG' if image.format == 'MPO' else image.format
+    if multiframe:
+        image.seek(0)
+    # JPEG умеет декодироваться сразу в уменьшенном масштабе.
+    image.draft(image.mode, (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    options = {}
+    if image_format == 'JPEG':
+        options = {
+            'quality': settings.POST_IMAGE_JPEG_QUALITY,
+            'optimize': True,
+        }
+    # Результат, как и загрузка, уходит на диск, если он крупнее
+    # FILE_UPLOAD_MAX_MEMORY_SIZE.
+    output = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    # Без параметра exif PIL сохраняет картинку без метаданных.
+    image.save(output, format=image_format, **options)
+    size = output.tell()
+    output.seek(0)
+    normalized = UploadedFile(output, upload.name, upload.content_type, size)
+    return normalized, image.width, image.height
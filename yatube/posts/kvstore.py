@@ -0,0 +1,62 @@
+"""Хранилище метаданных миниатюр sorl-thumbnail с пакетным чтением.
+
+Обычный KVStore спрашивает кэш, а при промахе базу отдельно для каждого
+тега {% thumbnail %}. Здесь view заранее сообщает ключи всей страницы,
+и первый же тег читает их разом: одним get_many из кэша и одним
+запросом к таблице sorl для того, чего в кэше нет. Таблица общая для
+всех процессов и переживает перезапуск, поэтому новому воркеру не нужно
+заново открывать файлы миниатюр, чтобы узнать их размеры.
+"""
+import threading
+
+from django.core.signals import request_started
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+EMPTY_VALUE = cached_db_kvstore.EMPTY_VALUE
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+        request_started.connect(self._forget, weak=False)
+
+    def expect(self, keys):
+        """Запоминает ключи, которые понадобятся при отрисовке страницы.
+
+        Сами ключи читаются лениво: если карточки страницы лежат в кэше
+        фрагментов, до хранилища дело не дойдёт.
+        """
+        self._local.pending = set(keys)
+        self._local.values = {}
+
+    def _forget(self, **kwargs):
+        self._local.pending = set()
+        self._local.values = {}
+
+    def _get_raw(self, key):
+        pending = getattr(self._local, 'pending', set())
+        if key in pending:
+            self._resolve(pending)
+        values = getattr(self._local, 'values', {})
+        if key in values:
+            value = values.pop(key)
+            return None if value is EMPTY_VALUE else value
+        return super()._get_raw(key)
+
+    def _resolve(self, keys):
+        self._local.pending = set()
+        values = self.cache.get_many(list(keys))
+        missing = keys - values.keys()
+        if missing:
+            stored = dict(KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list('key', 'value'))
+            self.cache.set_many(stored, settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(stored)
+            # Отсутствие в кэш не пишем: миниатюру может достроить другой
+            # процесс, а пустое значение хранилось бы у нас годами.
+            values.update(dict.fromkeys(missing - stored.keys(), EMPTY_VALUE))
+        self._local.values = values
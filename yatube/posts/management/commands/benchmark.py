@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (override_settings, setup_databases,
+                               setup_test_environment, teardown_databases,
+                               teardown_test_environment)
+from posts import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время, запросы, строки и память каждого маршрута на '
+        'синтетических базах и сравнивает с сохранённым baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', default=['small'],
+            choices=list(benchmarks.SIZES),
+            help='Размеры баз: число постов задаёт posts.benchmarks.SIZES.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=30,
+            help='Сколько раз открывать каждый маршрут.'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--baseline-dir',
+            default=os.path.join(settings.BASE_DIR, 'benchmarks'),
+        )
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Записать результаты как новый baseline.'
+        )
+        parser.add_argument(
+            '--compare', action='store_true',
+            help='Сравнить с baseline; при ухудшении команда падает.'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимый рост времени и памяти, доля; по умолчанию 0.2.'
+        )
+        parser.add_argument(
+            '--min-delta-ms', type=float, default=5.0,
+            help='Рост времени меньше этого не считается ухудшением.'
+        )
+
+    def handle(self, *args, **options):
+        regressions = []
+        for size in options['sizes']:
+            document = {
+                'size': size,
+                'posts': benchmarks.SIZES[size],
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+                'routes': self.measure(size, options),
+            }
+            self.stdout.write(self.style.MIGRATE_HEADING(size))
+            if options['compare']:
+                baseline = benchmarks.load_baseline(
+                    options['baseline_dir'], size
+                )
+                lines, worse = benchmarks.compare(
+                    document['routes'], baseline['routes'],
+                    options['threshold'], options['min_delta_ms']
+                )
+                regressions += [f'{size}: {name}' for name in worse]
+            else:
+                lines = [
+                    f'{name}: {metrics}'
+                    for name, metrics in document['routes'].items()
+                ]
+            for line in lines:
+                self.stdout.write(line)
+            if options['save']:
+                benchmarks.save_baseline(
+                    options['baseline_dir'], size, document
+                )
+        if regressions:
+            raise CommandError(
+                'Хуже baseline: ' + ', '.join(regressions)
+            )
+
+    def measure(self, size, options):
+        """Замеры на свежей тестовой базе; рабочие база и кэш не трогаются.
+
+        Иначе cache.clear() замеров стирал бы кэш сайта, а карточки
+        синтетических постов ложились бы под id настоящих.
+        """
+        media = tempfile.mkdtemp()
+        cache_dir = tempfile.mkdtemp()
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(
+                MEDIA_ROOT=media, THUMBNAIL_ASYNC=False,
+                CACHES=benchmarks.isolated_caches(cache_dir),
+            ):
+                call_command(
+                    'generate_dataset', posts=benchmarks.SIZES[size],
+                    seed=options['seed'], stdout=StringIO()
+                )
+                return benchmarks.run(options['repeat'])
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media, ignore_errors=True)
+            shutil.rmtree(cache_dir, ignore_errors=True)
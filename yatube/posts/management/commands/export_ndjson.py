@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from posts.ndjson import export_lines
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает пользователей, группы, посты, комментарии и подписки '
+        'в NDJSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', '-o', default='-',
+            help='Файл выгрузки; по умолчанию — стандартный вывод.'
+        )
+        parser.add_argument(
+            '--with-passwords', action='store_true',
+            help='Выгрузить и хэши паролей пользователей.'
+        )
+
+    def handle(self, *args, output='-', with_passwords=False, **options):
+        lines = export_lines(passwords=with_passwords)
+        if output == '-':
+            self.write(sys.stdout, lines)
+            return
+        with open(output, 'w', encoding='utf-8') as stream:
+            lines = self.write(stream, lines)
+        self.stderr.write(self.style.SUCCESS(f'Записей выгружено: {lines}'))
+
+    def write(self, stream, lines):
+        written = 0
+        for line in lines:
+            stream.write(line)
+            written += 1
+        return written
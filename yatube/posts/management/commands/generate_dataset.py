@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from posts.bulk import original_dates, rebuild_derived
+from posts.synthetic import Generator
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, группами, постами, '
+        'комментариями и подписками для нагрузочных прогонов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--posts', type=int, default=10000,
+            help='Сколько постов создать.'
+        )
+        parser.add_argument(
+            '--users', type=int,
+            help='Сколько пользователей; по умолчанию — пост на 20.'
+        )
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument(
+            '--comments', type=float, default=3.0,
+            help='Среднее число комментариев к посту.'
+        )
+        parser.add_argument(
+            '--follows', type=float, default=20.0,
+            help='Среднее число подписок пользователя.'
+        )
+        parser.add_argument(
+            '--images', type=float, default=0.2,
+            help='Доля постов с картинкой.'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--end', type=datetime.fromisoformat,
+            help='Дата самого позднего поста, ГГГГ-ММ-ДД; по умолчанию — '
+                 'сегодня.'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересчитывать счётчики, ленты и индекс поиска.'
+        )
+
+    def handle(self, *args, **options):
+        generator = Generator(
+            posts=options['posts'],
+            users=options['users'] or max(options['posts'] // 20, 2),
+            groups=options['groups'],
+            comments=options['comments'],
+            follows=options['follows'],
+            image_share=options['images'],
+            seed=options['seed'],
+            end=options['end'] and timezone.make_aware(options['end']),
+            chunk_size=options['chunk_size'],
+            log=self.stdout.write,
+        )
+        with transaction.atomic(), original_dates():
+            generator.run()
+        if not options['skip_derived']:
+            rebuild_derived(self.stdout)
+        self.stdout.write(self.style.SUCCESS('Данные созданы'))
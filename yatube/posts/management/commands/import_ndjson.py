@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from posts.bulk import original_dates, rebuild_derived
+from posts.ndjson import CHUNK_SIZE, Loader
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает NDJSON из export_ndjson пачками bulk_create в одной '
+        'транзакции, затем пересчитывает счётчики, ленты и индекс поиска.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл выгрузки; по умолчанию — стандартный ввод.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='По сколько записей разбирать и вставлять за раз.'
+        )
+
+    def handle(self, *args, path='-', chunk_size=CHUNK_SIZE, **options):
+        loader = Loader(chunk_size)
+        with transaction.atomic(), original_dates():
+            if path == '-':
+                self.load(loader, sys.stdin)
+            else:
+                with open(path, encoding='utf-8') as stream:
+                    self.load(loader, stream)
+        for label, number in loader.counts.items():
+            self.stdout.write(f'{label}: {number}')
+        rebuild_derived(self.stdout)
+        self.stdout.write(self.style.SUCCESS('Загрузка завершена'))
+
+    def load(self, loader, stream):
+        for line in stream:
+            if line.strip():
+                loader.add(line)
+        loader.flush()
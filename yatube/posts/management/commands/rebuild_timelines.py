@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from posts import timeline
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает ленты подписок, например после смены '
+        'TIMELINE_DEPTH или TIMELINE_FANOUT_LIMIT.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Чьи ленты пересобрать; по умолчанию — всех.'
+        )
+
+    def handle(self, *args, usernames=(), **options):
+        users = User.objects.filter(follower__isnull=False).distinct()
+        if usernames:
+            users = User.objects.filter(username__in=usernames)
+        rebuilt = 0
+        for user in users.iterator():
+            with transaction.atomic():
+                timeline.rebuild(user)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Лент пересобрано: {rebuilt}'))
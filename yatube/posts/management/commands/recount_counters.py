@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from posts.models import Comment, Follow, Post, User, UserStats
+
+
+def count_of(model, field, ref):
+    """Подзапрос COUNT(*) строк model, у которых field = внешний ref."""
+    rows = model.objects.filter(**{field: OuterRef(ref)}).order_by()
+    return Coalesce(Subquery(
+        rows.values(field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает хранимые счётчики и исправляет расхождения.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько счётчиков разошлось.'
+        )
+
+    def handle(self, *args, dry_run=False, **options):
+        checks = [
+            (Post.objects, 'comment_count', count_of(Comment, 'post', 'pk')),
+            (UserStats.objects, 'posts_count',
+             count_of(Post, 'author', 'user_id')),
+            (UserStats.objects, 'followers_count',
+             count_of(Follow, 'author', 'user_id')),
+            (UserStats.objects, 'follows_count',
+             count_of(Follow, 'user', 'user_id')),
+        ]
+        with transaction.atomic():
+            missing = User.objects.filter(stats__isnull=True)
+            self.report('stats rows missing', missing.count())
+            if not dry_run:
+                UserStats.objects.bulk_create(
+                    UserStats(user_id=pk)
+                    for pk in missing.values_list('pk', flat=True)
+                )
+            for manager, field, real in checks:
+                drifted = manager.exclude(**{field: real})
+                if dry_run:
+                    fixed = drifted.count()
+                else:
+                    fixed = drifted.update(**{field: real})
+                label = f'{manager.model.__name__}.{field}'
+                self.report(label, fixed)
+
+    def report(self, label, number):
+        style = self.style.WARNING if number else self.style.SUCCESS
+        self.stdout.write(style(f'{label}: {number}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Раскладывает подписчикам посты авторов, опустившихся до '
+        'TIMELINE_FANOUT_LIMIT. Запускайте по расписанию: отписка '
+        'только ставит автора в очередь.'
+    )
+
+    def handle(self, *args, **options):
+        resumed = 0
+        for author_id in list(timeline.pending_fan_outs()):
+            timeline.resume_fan_out(author_id)
+            resumed += 1
+        self.stdout.write(self.style.SUCCESS(f'Авторов разложено: {resumed}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from posts.models import Comment, Post
+from posts.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Строит полнотекстовый индекс постов и комментариев заново.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--optimize', action='store_true',
+            help='Только слить сегменты индекса, не перестраивая его.'
+        )
+
+    def handle(self, *args, optimize=False, **options):
+        backend = get_backend()
+        if not optimize:
+            with transaction.atomic():
+                backend.create()
+                backend.rebuild(
+                    Post.objects.values_list('pk', 'text').iterator(),
+                    Comment.objects.filter(post__isnull=False).values_list(
+                        'pk', 'text', 'post_id'
+                    ).iterator()
+                )
+        backend.optimize()
+        self.stdout.write(self.style.SUCCESS('Индекс поиска готов'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Подрезает ленты подписок, переросшие TIMELINE_DEPTH, '
+        'например после его уменьшения.'
+    )
+
+    def handle(self, *args, **options):
+        trimmed = 0
+        for user_id in list(timeline.overgrown()):
+            with transaction.atomic():
+                timeline.trim(user_id)
+            trimmed += 1
+        self.stdout.write(self.style.SUCCESS(f'Лент подрезано: {trimmed}'))
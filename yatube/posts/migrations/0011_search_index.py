@@ -0,0 +1,42 @@
+# Generated by Django 2.2.6 on 2026-10-18 03:10
+
+from django.db import migrations
+
+CREATE_INDEX = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS posts_search USING '
+    "fts5(text, post_id UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+FILL_INDEX = [
+    'INSERT INTO posts_search(rowid, text, post_id) '
+    'SELECT 2 * id, text, id FROM posts_post',
+    'INSERT INTO posts_search(rowid, text, post_id) '
+    'SELECT 2 * id + 1, text, post_id FROM posts_comment '
+    'WHERE post_id IS NOT NULL',
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 есть только в SQLite; на других базах индекс создаёт
+    # выбранный SEARCH_BACKEND командой search_index.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_INDEX)
+    for statement in FILL_INDEX:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
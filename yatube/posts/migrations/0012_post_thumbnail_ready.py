@@ -0,0 +1,26 @@
+# Generated by Django 2.2.6 on 2026-10-18 02:29
+
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    # Старые картинки показываются через {% thumbnail %}, как и раньше:
+    # миниатюра построится при первом показе, если её ещё нет.
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(thumbnail_ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_ready',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Миниатюры готовы'),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_comment_cursor_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SitemapSegment',
+            fields=[
+                ('number', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='Номер')),
+                ('root', models.CharField(blank=True, max_length=200, verbose_name='Адрес сайта')),
+                ('content', models.TextField(blank=True, verbose_name='XML')),
+                ('lastmod', models.DateTimeField(null=True, verbose_name='Последнее изменение')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия')),
+                ('built_version', models.PositiveIntegerField(null=True, verbose_name='Собрана из версии')),
+            ],
+            options={
+                'ordering': ['number'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_sitemap_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='pending_fan_outs',
+            field=models.PositiveIntegerField(default=0, verbose_name='Ждёт раскладки'),
+        ),
+    ]
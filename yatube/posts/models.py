@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import F
 
 User = get_user_model()
 
@@ -23,15 +24,19 @@ class Post(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    # Отдельные индексы по внешним ключам не нужны: их заменяют
+    # составные индексы из Meta, начинающиеся с этих полей.
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
         related_name='posts',
+        db_index=False,
         verbose_name='Автор'
     )
     group = models.ForeignKey(
         Group, on_delete=models.SET_NULL,
         related_name='posts',
         blank=True, null=True,
+        db_index=False,
         verbose_name='Группа'
     )
     image = models.ImageField(
@@ -39,12 +44,69 @@ class Post(models.Model):
         blank=True, null=True,
         verbose_name='Изображение'
     )
+    image_width = models.PositiveIntegerField(
+        'Ширина изображения',
+        blank=True, null=True,
+        editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота изображения',
+        blank=True, null=True,
+        editable=False
+    )
+    comment_count = models.PositiveIntegerField(
+        'Количество комментариев',
+        default=0,
+        editable=False
+    )
+    version = models.PositiveIntegerField(
+        'Версия карточки',
+        default=1,
+        editable=False
+    )
+    thumbnail_ready = models.BooleanField(
+        'Миниатюры готовы',
+        default=False,
+        editable=False
+    )
+
+    SERVICE_FIELDS = ('comment_count', 'version', 'thumbnail_ready')
 
     def __str__(self):
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        # Служебные поля меняются только запросами UPDATE: при правке
+        # поста не перезаписываем их значениями, прочитанными раньше.
+        if self._state.adding or kwargs.get('update_fields') is not None:
+            return super().save(*args, **kwargs)
+        kwargs['update_fields'] = [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.name not in self.SERVICE_FIELDS
+        ]
+        super().save(*args, **kwargs)
+        self.bump_version()
+
+    def bump_version(self):
+        """Сбрасывает закэшированную карточку поста."""
+        Post.objects.filter(pk=self.pk).update(version=F('version') + 1)
+        self.version += 1
+
     class Meta:
         ordering = ['-pub_date']
+        # Ленты автора и группы: фильтр по ключу и сортировка по дате
+        # идут по одному индексу, без временного B-дерева.
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_date_idx'
+            ),
+        ]
 
 
 class Comment(models.Model):
@@ -52,6 +114,7 @@ class Comment(models.Model):
         Post, on_delete=models.CASCADE,
         related_name='comments',
         blank=True, null=True,
+        db_index=False,
         verbose_name='Пост'
     )
     author = models.ForeignKey(
@@ -72,6 +135,13 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # Курсор страниц комментариев — (created, id).
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_date_idx'
+            ),
+        ]
 
 
 class Follow(models.Model):
@@ -101,3 +171,109 @@ class Follow(models.Model):
                 name='block_self_following'
             )
         ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые иначе считались бы COUNT'ом.
+
+    Обновляются сигналами в той же транзакции, что и запись, которая
+    их меняет; разошедшиеся значения чинит команда recount_counters.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE,
+        related_name='stats',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField('Записей', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    follows_count = models.PositiveIntegerField('Подписок', default=0)
+    # Сколько раз автор опускался до порога раскладки с тех пор, как
+    # команда resume_fan_out разложила его посты в последний раз.
+    pending_fan_outs = models.PositiveIntegerField(
+        'Ждёт раскладки', default=0
+    )
+
+    def __str__(self):
+        return f'Статистика {self.user.username}'
+
+    @classmethod
+    def for_user(cls, user):
+        """Счётчики пользователя; при первом обращении считает их."""
+        try:
+            return cls.objects.get(user=user)
+        except cls.DoesNotExist:
+            return cls.recalculate(user.pk)
+
+    @classmethod
+    def recalculate(cls, user_id):
+        stats, _ = cls.objects.update_or_create(
+            user_id=user_id,
+            defaults={
+                'posts_count': Post.objects.filter(author_id=user_id).count(),
+                'followers_count': Follow.objects.filter(
+                    author_id=user_id).count(),
+                'follows_count': Follow.objects.filter(
+                    user_id=user_id).count(),
+            }
+        )
+        return stats
+
+
+class TimelineEntry(models.Model):
+    """Запись ленты подписок, разложенная подписчику при публикации."""
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    def __str__(self):
+        return f'{self.user_id}<-{self.post_id}'
+
+    class Meta:
+        ordering = ['-pub_date', '-post_id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_date_idx'
+            ),
+        ]
+
+
+class SitemapSegment(models.Model):
+    """Готовая часть карты сайта: посты с id из одного диапазона.
+
+    version растёт при каждой записи, которая меняет часть; сохранённый
+    XML свежий, пока built_version совпадает с ним. Собирает часть
+    posts.sitemaps.
+    """
+    number = models.PositiveIntegerField('Номер', primary_key=True)
+    root = models.CharField('Адрес сайта', max_length=200, blank=True)
+    content = models.TextField('XML', blank=True)
+    lastmod = models.DateTimeField('Последнее изменение', null=True)
+    version = models.PositiveIntegerField('Версия', default=0)
+    built_version = models.PositiveIntegerField(
+        'Собрана из версии', null=True
+    )
+
+    def __str__(self):
+        return f'sitemap-{self.number}'
+
+    @property
+    def is_fresh(self):
+        return self.built_version == self.version
+
+    class Meta:
+        ordering = ['number']
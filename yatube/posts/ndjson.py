@@ -0,0 +1,226 @@
+"""Выгрузка и загрузка данных в NDJSON: одна запись — одна строка.
+
+Пользователи и группы связываются по username и slug, посты и
+комментарии сохраняют свои id — по ним комментарии ссылаются на посты.
+Поэтому id, занятый в базе другой записью, останавливает загрузку.
+Записи идут в порядке зависимостей: user, group, post, comment, follow.
+Хэши паролей выгружаются только по явному запросу; пользователи без
+них загружаются с непригодным паролем и входят через сброс пароля.
+"""
+import json
+
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Comment, Follow, Group, Post, User
+
+CHUNK_SIZE = 500
+
+# Имя поля в записи -> колонка в values().
+COLUMNS = {
+    'user': (User, {
+        'username': 'username',
+        'first_name': 'first_name',
+        'last_name': 'last_name',
+        'email': 'email',
+        'password': 'password',
+        'is_active': 'is_active',
+        'date_joined': 'date_joined',
+    }),
+    'group': (Group, {
+        'slug': 'slug',
+        'title': 'title',
+        'description': 'description',
+    }),
+    'post': (Post, {
+        'id': 'pk',
+        'text': 'text',
+        'pub_date': 'pub_date',
+        'author': 'author__username',
+        'group': 'group__slug',
+        'image': 'image',
+    }),
+    'comment': (Comment, {
+        'id': 'pk',
+        'post': 'post_id',
+        'author': 'author__username',
+        'text': 'text',
+        'created': 'created',
+    }),
+    'follow': (Follow, {
+        'user': 'user__username',
+        'author': 'author__username',
+    }),
+}
+
+
+def export_lines(passwords=False):
+    """Строки NDJSON всей базы; в памяти не больше CHUNK_SIZE строк."""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for label, (model, columns) in COLUMNS.items():
+        if label == 'user' and not passwords:
+            columns = {
+                name: column for name, column in columns.items()
+                if name != 'password'
+            }
+        rows = model.objects.order_by('pk').values(*columns.values())
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            record = {'model': label}
+            for name, column in columns.items():
+                record[name] = row[column]
+            yield encoder.encode(record) + '\n'
+
+
+def resolve(model, field, values):
+    """Словарь значение -> pk одним запросом на пачку."""
+    values = {value for value in values if value is not None}
+    found = dict(model.objects.filter(
+        **{f'{field}__in': values}
+    ).values_list(field, 'pk'))
+    missing = values - found.keys()
+    if missing:
+        raise CommandError('{} не найдены: {}'.format(
+            model._meta.verbose_name_plural, ', '.join(map(str, missing))
+        ))
+    return found
+
+
+def ensure_same(label, records, names):
+    """Занятые id должны принадлежать тем же записям, что и в файле.
+
+    Иначе ignore_conflicts молча пропустил бы пост, а комментарии к нему
+    по тому же post легли бы под чужой пост. Сравниваются поля names.
+    """
+    model, columns = COLUMNS[label]
+    existing = {
+        pk: values for pk, *values in model.objects.filter(
+            pk__in=[record['id'] for record in records]
+        ).values_list('pk', *(columns[name] for name in names))
+    }
+    taken = [
+        record['id'] for record in records
+        if record['id'] in existing
+        and existing[record['id']] != [record[name] for name in names]
+    ]
+    if taken:
+        raise CommandError('id {} заняты другими записями: {}'.format(
+            model._meta.verbose_name_plural, ', '.join(map(str, taken))
+        ))
+
+
+def build_users(records):
+    users = [User(**record) for record in records]
+    for user in users:
+        if not user.password:
+            user.set_unusable_password()
+    return users
+
+
+def build_groups(records):
+    return [Group(**record) for record in records]
+
+
+def build_posts(records):
+    authors = resolve(User, 'username', (r['author'] for r in records))
+    groups = resolve(Group, 'slug', (r['group'] for r in records))
+    ensure_same('post', records, ('author', 'text'))
+    return [
+        Post(
+            pk=record['id'],
+            text=record['text'],
+            pub_date=record['pub_date'],
+            author_id=authors[record['author']],
+            group_id=groups.get(record['group']),
+            image=record['image'] or '',
+        )
+        for record in records
+    ]
+
+
+def build_comments(records):
+    authors = resolve(User, 'username', (r['author'] for r in records))
+    resolve(Post, 'pk', (r['post'] for r in records))
+    ensure_same('comment', records, ('post', 'author', 'text'))
+    return [
+        Comment(
+            pk=record['id'],
+            post_id=record['post'],
+            author_id=authors[record['author']],
+            text=record['text'],
+            created=record['created'],
+        )
+        for record in records
+    ]
+
+
+def build_follows(records):
+    users = resolve(User, 'username', (
+        username for r in records for username in (r['user'], r['author'])
+    ))
+    return [
+        Follow(
+            user_id=users[record['user']],
+            author_id=users[record['author']]
+        )
+        for record in records
+    ]
+
+
+BUILDERS = {
+    'user': build_users,
+    'group': build_groups,
+    'post': build_posts,
+    'comment': build_comments,
+    'follow': build_follows,
+}
+
+
+class Loader:
+    """Копит записи одной модели и вставляет их пачками.
+
+    bulk_create не отправляет сигналы, поэтому счётчики, ленты и индекс
+    поиска во время загрузки не трогаются — их пересобирают после.
+    Уже существующие строки (тот же username, slug, id) пропускаются,
+    поэтому вставленные строки считаются по числу строк таблицы до и
+    после загрузки, а не по числу записей.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.label = None
+        self.records = []
+        self.before = {}
+
+    @property
+    def counts(self):
+        """Сколько строк каждой модели действительно добавлено."""
+        return {
+            label: (
+                COLUMNS[label][0].objects.count() - self.before[label]
+                if label in self.before else 0
+            )
+            for label in BUILDERS
+        }
+
+    def add(self, line):
+        try:
+            record = json.loads(line)
+            label = record.pop('model')
+        except (ValueError, AttributeError, KeyError):
+            raise CommandError(f'Не запись NDJSON: {line[:80]!r}')
+        if label not in BUILDERS:
+            raise CommandError(f'Неизвестная модель: {label}')
+        if label != self.label or len(self.records) >= self.chunk_size:
+            self.flush()
+            self.label = label
+        self.records.append(record)
+
+    def flush(self):
+        if not self.records:
+            return
+        model = COLUMNS[self.label][0]
+        if self.label not in self.before:
+            self.before[self.label] = model.objects.count()
+        objects = BUILDERS[self.label](self.records)
+        model.objects.bulk_create(objects, ignore_conflicts=True)
+        self.records = []
@@ -0,0 +1,188 @@
+import base64
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.shortcuts import redirect
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, value, pk):
+    """Упаковывает позицию в ленте в непрозрачный токен для URL."""
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    raw = f'{direction}|{value}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковывает токен, на мусор поднимает ValueError.
+
+    Значение ключа возвращается строкой: привести его к типу поля
+    может только паджинатор.
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    direction, value, pk = raw.split('|')
+    if direction not in (NEXT, PREVIOUS):
+        raise ValueError(f'Неизвестное направление курсора: {direction}')
+    return direction, value, int(pk)
+
+
+class CursorPaginator(Paginator):
+    """Паджинатор по ключу (key, id), по умолчанию (pub_date, id).
+
+    Не выполняет COUNT(*) и OFFSET: каждая страница — один запрос
+    с условием по ключу и LIMIT, поэтому глубокие страницы стоят
+    столько же, сколько первая. Вместо номеров страниц у объекта
+    Page есть токены next_cursor и previous_cursor.
+
+    Строками страницы могут быть и словари из values(): тогда в них
+    должны быть 'pk' и key.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, key='pub_date'):
+        self.key = key
+        ordering = ['-pk'] if key == 'pk' else [f'-{key}', '-pk']
+        super().__init__(object_list.order_by(*ordering), per_page)
+        self._num_pages = 1
+
+    @property
+    def num_pages(self):
+        # Номер страницы при курсорной навигации неизвестен, поэтому
+        # Page получает номер 1 или 2 и ровно столько страниц, сколько
+        # нужно для верных has_previous/has_next.
+        return self._num_pages
+
+    def get_page(self, cursor):
+        if not cursor:
+            return self._first_page()
+        try:
+            direction, value, pk = decode_cursor(cursor)
+            value = self._parse_value(value)
+        except (ValueError, ValidationError):
+            return self._first_page()
+        if direction == NEXT:
+            return self._page_after(value, pk)
+        return self._page_before(value, pk)
+
+    def legacy_cursor(self, number):
+        """Токен, открывающий ту же страницу, что и старый ?page=N."""
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return None
+        if number <= 1:
+            return None
+        anchor = self._anchor((number - 1) * self.per_page - 1)
+        if anchor is None:
+            return None
+        return encode_cursor(NEXT, *anchor)
+
+    def _anchor(self, offset):
+        """Позиция (значение ключа, id) строки с номером offset."""
+        return self.object_list.values_list(self.key, 'pk')[
+            offset:offset + 1
+        ].first()
+
+    def _parse_value(self, value):
+        meta = self.object_list.model._meta
+        field = meta.pk if self.key == 'pk' else meta.get_field(self.key)
+        value = field.to_python(value)
+        if value is None:
+            raise ValueError('Пустое значение ключа в курсоре')
+        return value
+
+    def _position(self, row):
+        if isinstance(row, dict):
+            return row[self.key], row['pk']
+        return getattr(row, self.key), row.pk
+
+    def _older(self, value, pk):
+        if self.key == 'pk':
+            return Q(pk__lt=pk)
+        return Q(**{f'{self.key}__lt': value}) | Q(
+            **{self.key: value, 'pk__lt': pk}
+        )
+
+    def _newer(self, value, pk):
+        if self.key == 'pk':
+            return Q(pk__gt=pk)
+        return Q(**{f'{self.key}__gt': value}) | Q(
+            **{self.key: value, 'pk__gt': pk}
+        )
+
+    def _rows(self, position=None, older=True):
+        """До per_page + 1 строк после position в сторону older.
+
+        Без position — с начала ленты. Строки идут в порядке обхода:
+        к старым — от новых, к новым — от старых.
+        """
+        rows = self.object_list
+        if position is not None:
+            rows = rows.filter(
+                self._older(*position) if older else self._newer(*position)
+            )
+        if not older:
+            rows = rows.reverse()
+        return list(rows[:self.per_page + 1])
+
+    def _first_page(self):
+        rows = self._rows()
+        return self._build_page(
+            rows[:self.per_page],
+            has_previous=False,
+            has_next=len(rows) > self.per_page
+        )
+
+    def _page_after(self, value, pk):
+        rows = self._rows((value, pk))
+        if not rows:
+            return self._first_page()
+        return self._build_page(
+            rows[:self.per_page],
+            has_previous=True,
+            has_next=len(rows) > self.per_page
+        )
+
+    def _page_before(self, value, pk):
+        rows = self._rows((value, pk), older=False)
+        if len(rows) <= self.per_page:
+            # Дошли до начала ленты — отдаём каноничную первую страницу,
+            # чтобы она была полной даже после удаления записей.
+            return self._first_page()
+        return self._build_page(
+            rows[:self.per_page][::-1],
+            has_previous=True,
+            has_next=True
+        )
+
+    def _build_page(self, rows, has_previous, has_next):
+        number = 2 if has_previous else 1
+        self._num_pages = number + 1 if has_next else number
+        page = Page(rows, number, self)
+        page.previous_cursor = None
+        page.next_cursor = None
+        if has_previous:
+            page.previous_cursor = encode_cursor(
+                PREVIOUS, *self._position(rows[0])
+            )
+        if has_next:
+            page.next_cursor = encode_cursor(
+                NEXT, *self._position(rows[-1])
+            )
+        return page
+
+
+def legacy_page_redirect(request, paginator):
+    """Перенаправляет старую ссылку ?page=N на курсорную страницу."""
+    query = request.GET.copy()
+    cursor = paginator.legacy_cursor(query.pop('page', [None])[-1])
+    if cursor:
+        query['cursor'] = cursor
+    if query:
+        return redirect(f'{request.path}?{query.urlencode()}')
+    return redirect(request.path)
@@ -0,0 +1,253 @@
+"""Профилирование запросов по фазам.
+
+ProfilingMiddleware меряет время view, SQL (число и суммарное время),
+отрисовки шаблонов и миниатюр, считает попадания и промахи кэша, отдаёт
+разбивку в заголовке Server-Timing и копит гистограммы по маршрутам,
+которые показывает request_stats. Включается настройкой
+REQUEST_PROFILING; без неё middleware снимает себя при запуске
+(MiddlewareNotUsed) и ничего не подменяет, так что не стоит ничего.
+
+Middleware должна стоять последней в MIDDLEWARE: тогда время view
+почти не включает работу других middleware. Запросы считаются по всем
+базам, включая реплики. У потокового ответа заголовок уходит раньше
+тела, поэтому Server-Timing в нём помечен как partial, а в гистограмму
+маршрута время попадает, когда поток дочитан или закрыт.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+from django.template.base import Template
+from sorl.thumbnail.base import ThumbnailBackend
+
+from . import coalescing
+
+# Верхние границы корзин гистограммы, мс; последняя корзина — всё дольше.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_local = threading.local()
+_lock = threading.Lock()
+_routes = {}
+_installed = False
+
+
+class Recorder:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.thumbnail = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+def timed(attribute):
+    """Добавляет время вызова к полю активного Recorder.
+
+    Вложенные вызовы (include внутри шаблона) не считаются дважды.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = current()
+            if recorder is None or getattr(recorder, 'in_' + attribute, 0):
+                return function(*args, **kwargs)
+            setattr(recorder, 'in_' + attribute, 1)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                setattr(recorder, 'in_' + attribute, 0)
+                setattr(recorder, attribute, getattr(recorder, attribute)
+                        + time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def counted_get(function):
+    @wraps(function)
+    def wrapper(self, key, default=None, *args, **kwargs):
+        value = function(self, key, default, *args, **kwargs)
+        recorder = current()
+        if recorder is not None:
+            if value is default:
+                recorder.misses += 1
+            else:
+                recorder.hits += 1
+        return value
+    return wrapper
+
+
+def counted_get_many(function):
+    @wraps(function)
+    def wrapper(self, keys, *args, **kwargs):
+        keys = list(keys)
+        found = function(self, keys, *args, **kwargs)
+        recorder = current()
+        if recorder is not None:
+            recorder.hits += len(found)
+            recorder.misses += len(keys) - len(found)
+        return found
+    return wrapper
+
+
+def front_caches():
+    """Алиасы кэшей, к которым обращается код, без их нижних уровней L2."""
+    lower = {
+        params.get('OPTIONS', {}).get('L2')
+        for params in settings.CACHES.values()
+    }
+    return [alias for alias in settings.CACHES if alias not in lower]
+
+
+def install():
+    """Подменяет отрисовку шаблонов, миниатюр и чтение кэшей один раз."""
+    global _installed
+    if _installed:
+        return
+    Template.render = timed('template')(Template.render)
+    ThumbnailBackend.get_thumbnail = timed('thumbnail')(
+        ThumbnailBackend.get_thumbnail
+    )
+    for backend in {type(caches[alias]) for alias in front_caches()}:
+        backend.get = counted_get(backend.get)
+        backend.get_many = counted_get_many(backend.get_many)
+    _installed = True
+
+
+def record(route, total, recorder):
+    with _lock:
+        stats = _routes.setdefault(route, {
+            'count': 0,
+            'total_ms': 0.0,
+            'db_ms': 0.0,
+            'queries': 0,
+            'template_ms': 0.0,
+            'thumbnail_ms': 0.0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'histogram': [0] * (len(BUCKETS) + 1),
+        })
+        stats['count'] += 1
+        stats['total_ms'] += total * 1000
+        stats['db_ms'] += recorder.db * 1000
+        stats['queries'] += recorder.queries
+        stats['template_ms'] += recorder.template * 1000
+        stats['thumbnail_ms'] += recorder.thumbnail * 1000
+        stats['cache_hits'] += recorder.hits
+        stats['cache_misses'] += recorder.misses
+        stats['histogram'][bisect_left(BUCKETS, total * 1000)] += 1
+
+
+def snapshot():
+    with _lock:
+        routes = {
+            route: dict(stats, histogram=list(stats['histogram']))
+            for route, stats in _routes.items()
+        }
+    return {
+        'buckets_ms': list(BUCKETS),
+        'routes': routes,
+        'coalescing': coalescing.metrics(),
+        'caches': {
+            alias: caches[alias].stats() for alias in front_caches()
+            if hasattr(caches[alias], 'stats')
+        },
+    }
+
+
+def reset():
+    with _lock:
+        _routes.clear()
+
+
+@contextmanager
+def recording(recorder):
+    """Делает recorder активным и считает им SQL всех баз."""
+    _local.recorder = recorder
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            yield
+    finally:
+        _local.recorder = None
+
+
+def measured(content, route, started, recorder):
+    """Тело потокового ответа, которое пишет статистику после себя."""
+    try:
+        with recording(recorder):
+            yield from content
+    finally:
+        record(route, time.perf_counter() - started, recorder)
+
+
+def server_timing(view, recorder):
+    return ', '.join([
+        f'view;dur={view * 1000:.1f}',
+        f'db;dur={recorder.db * 1000:.1f};desc="{recorder.queries} queries"',
+        f'tpl;dur={recorder.template * 1000:.1f}',
+        f'thumb;dur={recorder.thumbnail * 1000:.1f}',
+        f'cache;desc="{recorder.hits} hits, {recorder.misses} misses"',
+    ])
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = Recorder()
+        request.profiling_view_started = None
+        with recording(recorder):
+            response = self.get_response(request)
+        finished = time.perf_counter()
+        started = request.profiling_view_started
+        if started is None:
+            return response
+        view = finished - started
+        timing = server_timing(view, recorder)
+        match = request.resolver_match
+        route = match.view_name if match else request.path
+        if response.streaming:
+            response['Server-Timing'] = f'{timing}, stream;desc="partial"'
+            response.streaming_content = measured(
+                response.streaming_content, route, started, recorder
+            )
+        else:
+            response['Server-Timing'] = timing
+            record(route, view, recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profiling_view_started = time.perf_counter()
+
+
+@staff_member_required
+def request_stats(request):
+    """Накопленные в этом процессе гистограммы маршрутов."""
+    return JsonResponse(snapshot(), json_dumps_params={'ensure_ascii': False})
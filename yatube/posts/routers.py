@@ -0,0 +1,92 @@
+"""Чтение с реплик, запись в основную базу.
+
+Реплики перечислены в DATABASE_REPLICAS и объявлены в DATABASES как
+копии основной базы (TEST: MIRROR на default). Локально реплика — это
+второй файл SQLite, который обновляет manage.py sync_replicas.
+
+ReplicaMiddleware выбирает реплику для GET и HEAD запроса, одну на весь
+запрос, чтобы страница не собиралась из разных снимков. Всё остальное —
+и любой запрос после собственной записи — читает основную базу: после
+записи ответ ставит cookie на REPLICA_LAG секунд, и пользователь сразу
+видит свой пост, комментарий или подписку. Вне запросов (команды,
+фоновые потоки) реплики не используются.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'read_primary'
+SAFE_METHODS = ('GET', 'HEAD')
+# Сессия нужна сразу после входа, а метаданные миниатюр пишутся в фоне:
+# на реплике они отстают, поэтому эти приложения всегда читают основную
+# базу, и их запись не прилепляет пользователя к ней.
+PRIMARY_APPS = {'sessions', 'thumbnail'}
+
+_state = threading.local()
+
+
+def current_replica():
+    return getattr(_state, 'replica', None)
+
+
+def cache_timeout(timeout):
+    """Срок кэша страницы: собранная с реплики живёт не дольше её отставания.
+
+    Иначе устаревшая страница легла бы в кэш под новым поколением
+    и пережила бы синхронизацию реплики.
+    """
+    if current_replica() is None:
+        return timeout
+    return min(timeout, settings.REPLICA_LAG)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label not in PRIMARY_APPS:
+            _state.replica = None
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.wrote = False
+        if (request.method in SAFE_METHODS
+                and PIN_COOKIE not in request.COOKIES):
+            _state.replica = random.choice(settings.DATABASE_REPLICAS)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.replica = None
+        if _state.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_LAG,
+                httponly=True, samesite='Lax'
+            )
+        return response
@@ -0,0 +1,189 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+Индекс хранится отдельно от моделей и обновляется сигналами при
+сохранении и удалении. Реализация выбирается настройкой SEARCH_BACKEND,
+по умолчанию — таблица FTS5 в SQLite.
+"""
+import re
+from collections import namedtuple
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import connection
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+
+BATCH_SIZE = 1000
+
+Hit = namedtuple('Hit', ['post_id', 'comment_id', 'snippet', 'rank'])
+
+# Границы совпадения в сниппете: управляющие символы не встречаются
+# в тексте, поэтому их можно заменить на теги уже после escape().
+MARK_START = '\x02'
+MARK_END = '\x03'
+# FTS5 обрывает строку на NUL и не ждёт других управляющих символов.
+CONTROL_CHARS = re.compile('[\x00-\x1f\x7f]')
+
+
+def to_match_query(query):
+    """Превращает ввод пользователя в запрос, где все слова обязательны.
+
+    Каждое слово берётся в кавычки, чтобы операторы FTS (NEAR, OR, *)
+    из строки поиска не интерпретировались. Управляющие символы
+    разделяют слова, как пробел.
+    """
+    words = CONTROL_CHARS.sub(' ', query).split()
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def highlight(snippet):
+    return escape(snippet).replace(MARK_START, '<mark>').replace(
+        MARK_END, '</mark>'
+    )
+
+
+class SearchBackend:
+    """Интерфейс индекса; методы вызываются внутри транзакции записи."""
+
+    def index_post(self, post):
+        raise NotImplementedError
+
+    def index_comment(self, comment):
+        raise NotImplementedError
+
+    def remove_post(self, post_id):
+        raise NotImplementedError
+
+    def remove_comment(self, comment_id):
+        raise NotImplementedError
+
+    def search(self, query, limit, kind=None):
+        """Лучшие совпадения — список Hit, по убыванию релевантности.
+
+        kind ограничивает поиск постами ('post') или комментариями
+        ('comment').
+        """
+        raise NotImplementedError
+
+    def create(self):
+        """Создаёт хранилище индекса, если его ещё нет."""
+        raise NotImplementedError
+
+    def rebuild(self, posts, comments):
+        raise NotImplementedError
+
+    def optimize(self):
+        pass
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """Индекс в виртуальной таблице FTS5 posts_search.
+
+    rowid посту выдаётся чётный (2 * id), комментарию — нечётный
+    (2 * id + 1): так строку обновляют и удаляют по rowid, не
+    просматривая таблицу.
+    """
+    table = 'posts_search'
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING '
+                "fts5(text, post_id UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+
+    def _upsert(self, rowid, text, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {self.table}(rowid, text, post_id) '
+                'VALUES (%s, %s, %s)',
+                [rowid, text, post_id]
+            )
+
+    def _delete(self, rowid):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [rowid]
+            )
+
+    def index_post(self, post):
+        self._upsert(2 * post.pk, post.text, post.pk)
+
+    def index_comment(self, comment):
+        if comment.post_id is None:
+            return self.remove_comment(comment.pk)
+        self._upsert(2 * comment.pk + 1, comment.text, comment.post_id)
+
+    def remove_post(self, post_id):
+        self._delete(2 * post_id)
+
+    def remove_comment(self, comment_id):
+        self._delete(2 * comment_id + 1)
+
+    def search(self, query, limit, kind=None):
+        match = to_match_query(query)
+        if not match:
+            return []
+        parity = {
+            'post': 'AND rowid %% 2 = 0',
+            'comment': 'AND rowid %% 2 = 1',
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, post_id, '
+                f'snippet({self.table}, 0, %s, %s, %s, 16), '
+                f'bm25({self.table}) AS rank '
+                f'FROM {self.table} WHERE {self.table} MATCH %s '
+                f'{parity.get(kind, "")} ORDER BY rank LIMIT %s',
+                [MARK_START, MARK_END, '…', match, limit]
+            )
+            rows = cursor.fetchall()
+        return [
+            Hit(
+                post_id=post_id,
+                comment_id=rowid // 2 if rowid % 2 else None,
+                snippet=highlight(snippet),
+                rank=rank,
+            )
+            for rowid, post_id, snippet, rank in rows
+        ]
+
+    def rebuild(self, posts, comments):
+        """Заполняет индекс заново.
+
+        posts — итератор пар (id, text), comments — троек
+        (id, text, post_id).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            insert = (
+                f'INSERT INTO {self.table}(rowid, text, post_id) '
+                'VALUES (%s, %s, %s)'
+            )
+            rows = chain(
+                ((2 * pk, text, pk) for pk, text in posts),
+                ((2 * pk + 1, text, post_id)
+                 for pk, text, post_id in comments),
+            )
+            while True:
+                batch = list(islice(rows, BATCH_SIZE))
+                if not batch:
+                    break
+                cursor.executemany(insert, batch)
+
+    def optimize(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')"
+            )
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    return _backend
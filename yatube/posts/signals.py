@@ -0,0 +1,274 @@
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import sitemaps, thumbnails, timeline
+from .caching import (author_stamp_key, bump_generations, follower_stamp_key,
+                      group_scope, index_scope, post_scopes, profile_scope,
+                      touch_stamps)
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .search import get_backend
+
+# Поля пользователя, которые показываются на страницах его постов.
+NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def bump_user(user_id, field, delta):
+    stats = UserStats.objects.filter(user_id=user_id)
+    if delta < 0:
+        # Не уводим счётчик в минус: разошедшиеся значения чинит
+        # recount_counters, а строки удаляемого пользователя не трогаем.
+        stats = stats.filter(**{f'{field}__gte': -delta})
+    updated = stats.update(**{field: F(field) + delta})
+    if not updated and delta > 0:
+        # Строки ещё нет — считаем её целиком, запись уже в базе.
+        UserStats.recalculate(user_id)
+
+
+def follow_usernames(follow):
+    """Имена подписчика и автора; загруженных view пользователей не читаем.
+
+    Иначе instance.user и instance.author стоили бы по запросу.
+    """
+    if Follow.user.is_cached(follow) and Follow.author.is_cached(follow):
+        return follow.user.username, follow.author.username
+    usernames = dict(User.objects.filter(
+        pk__in=[follow.user_id, follow.author_id]
+    ).values_list('pk', 'username'))
+    return usernames[follow.user_id], usernames[follow.author_id]
+
+
+def bump_post(post_id, delta):
+    posts = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        posts = posts.filter(comment_count__gte=-delta)
+    posts.update(
+        comment_count=F('comment_count') + delta,
+        version=F('version') + 1
+    )
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        bump_user(instance.author_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_user(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created and instance.post_id is not None:
+        bump_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        bump_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        bump_user(instance.author_id, 'followers_count', 1)
+        bump_user(instance.user_id, 'follows_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    bump_user(instance.author_id, 'followers_count', -1)
+    bump_user(instance.user_id, 'follows_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def post_published(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follow)
+def unfollow_timeline(sender, instance, **kwargs):
+    timeline.drop(instance.user_id, instance.author_id)
+    # Счётчик уже уменьшил follow_deleted.
+    timeline.schedule_fan_out(instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous(sender, instance, **kwargs):
+    # Пост, перенесённый в другую группу, нужно убрать и со страницы
+    # прежней группы, а для новой картинки — построить миниатюры.
+    instance.previous_group_slug = None
+    instance.previous_image = None
+    if instance.pk:
+        previous = Post.objects.filter(pk=instance.pk).values_list(
+            'group__slug', 'image'
+        ).first()
+        if previous:
+            instance.previous_group_slug, instance.previous_image = previous
+
+
+@receiver(post_save, sender=Post)
+def post_pages_changed(sender, instance, **kwargs):
+    previous = instance.previous_group_slug
+    bump_generations(
+        *post_scopes(instance), previous and group_scope(previous)
+    )
+    touch_stamps(author_stamp_key(instance.author_id))
+
+
+@receiver(post_delete, sender=Post)
+def post_pages_deleted(sender, instance, **kwargs):
+    bump_generations(*post_scopes(instance))
+    touch_stamps(author_stamp_key(instance.author_id))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_pages_changed(sender, instance, **kwargs):
+    try:
+        post = instance.post
+    except Post.DoesNotExist:
+        # Комментарий удаляется вместе с постом — страницы сбросит пост.
+        return
+    if post is not None:
+        bump_generations(*post_scopes(post))
+        touch_stamps(author_stamp_key(post.author_id))
+
+
+def group_posts_changed(group, *slugs):
+    """Сбрасывает страницы и карточки постов группы, где видно её название.
+
+    slugs — адреса группы, страницы которых тоже нужно сбросить.
+    """
+    posts = Post.objects.filter(group=group)
+    authors = list(posts.order_by().values_list(
+        'author_id', 'author__username'
+    ).distinct())
+    bump_generations(
+        index_scope(), *(group_scope(slug) for slug in slugs if slug),
+        *(profile_scope(username) for _, username in authors)
+    )
+    touch_stamps(*(author_stamp_key(author_id) for author_id, _ in authors))
+    posts.update(version=F('version') + 1)
+
+
+@receiver(pre_save, sender=Group)
+def remember_slug(sender, instance, **kwargs):
+    instance.previous_slug = None
+    if instance.pk:
+        instance.previous_slug = Group.objects.filter(
+            pk=instance.pk
+        ).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+def group_pages_changed(sender, instance, created, **kwargs):
+    if created:
+        bump_generations(group_scope(instance.slug))
+        return
+    # Страница и лента по прежнему адресу тоже устарели.
+    group_posts_changed(instance, instance.slug, instance.previous_slug)
+
+
+@receiver(pre_delete, sender=Group)
+def group_pages_deleted(sender, instance, **kwargs):
+    # После удаления у постов уже не будет группы, по которой их искать.
+    group_posts_changed(instance, instance.slug)
+
+
+@receiver(pre_save, sender=User)
+def remember_names(sender, instance, update_fields=None, **kwargs):
+    # Вход сохраняет только last_login: имена тогда не читаем.
+    instance.previous_names = None
+    if instance.pk and (
+        update_fields is None or set(update_fields) & set(NAME_FIELDS)
+    ):
+        instance.previous_names = User.objects.filter(
+            pk=instance.pk
+        ).values_list(*NAME_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def author_names_changed(sender, instance, created, **kwargs):
+    previous = getattr(instance, 'previous_names', None)
+    current = tuple(getattr(instance, field) for field in NAME_FIELDS)
+    if created or previous in (None, current):
+        return
+    # Имя автора есть в карточках его постов, полное имя — в карточке
+    # профиля и в лентах; страница по прежнему имени тоже устарела.
+    posts = Post.objects.filter(author=instance)
+    groups = posts.exclude(group=None).order_by().values_list(
+        'group__slug', flat=True
+    ).distinct()
+    bump_generations(
+        index_scope(), profile_scope(instance.username),
+        profile_scope(previous[0]),
+        *(group_scope(slug) for slug in groups)
+    )
+    touch_stamps(author_stamp_key(instance.pk))
+    posts.update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_pages_changed(sender, instance, **kwargs):
+    bump_generations(*(
+        profile_scope(username) for username in follow_usernames(instance)
+    ))
+    touch_stamps(follower_stamp_key(instance.user_id))
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    get_backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    get_backend().remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    get_backend().index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    get_backend().remove_comment(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def sitemap_post_added(sender, instance, created, **kwargs):
+    # Правка не меняет ни адрес поста, ни его lastmod.
+    if created:
+        sitemaps.mark_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def sitemap_post_deleted(sender, instance, **kwargs):
+    sitemaps.mark_changed(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def sitemap_comment_changed(sender, instance, **kwargs):
+    if instance.post_id is not None:
+        sitemaps.mark_changed(instance.post_id)
+
+
+@receiver(post_save, sender=Post)
+def image_changed(sender, instance, **kwargs):
+    if instance.image and instance.image.name != instance.previous_image:
+        thumbnails.schedule(instance)
@@ -0,0 +1,142 @@
+"""Карта сайта частями по диапазонам id постов.
+
+Часть number содержит посты с id от number * SITEMAP_SEGMENT_SIZE до
+следующей границы. Собранная часть хранится в SitemapSegment и
+пересобирается, только когда сменилась её версия: новый пост меняет
+лишь последнюю часть, комментарий или удаление — часть своего поста.
+Закрытые части, в которые посты больше не добавляются, собираются
+один раз. lastmod записи — позднейшая из даты поста и его последнего
+комментария.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F, Max, OuterRef, Subquery
+from django.http import Http404, HttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from . import writes
+from .budgets import query_budget
+from .models import Comment, Post, SitemapSegment
+
+CONTENT_TYPE = 'application/xml; charset=utf-8'
+
+
+def segment_number(post_id):
+    return post_id // settings.SITEMAP_SEGMENT_SIZE
+
+
+def mark_changed(post_id):
+    """Помечает часть с постом post_id устаревшей."""
+    SitemapSegment.objects.filter(number=segment_number(post_id)).update(
+        version=F('version') + 1
+    )
+
+
+def reset():
+    """Помечает устаревшими все части: после записи в обход сигналов."""
+    SitemapSegment.objects.update(version=F('version') + 1)
+
+
+def newest_segment():
+    # MAX по первичному ключу — один шаг по индексу, без сортировки.
+    last_id = Post.objects.aggregate(last_id=Max('pk'))['last_id']
+    return None if last_id is None else segment_number(last_id)
+
+
+def entries(number):
+    """id, автор, дата и последний комментарий постов части number.
+
+    Читаем основную базу: часть с отстающей реплики легла бы в хранилище
+    под текущей версией и не пересобралась бы.
+    """
+    start = number * settings.SITEMAP_SEGMENT_SIZE
+    last_comment = Comment.objects.filter(
+        post=OuterRef('pk')
+    ).order_by('-created').values('created')[:1]
+    return Post.objects.using(DEFAULT_DB_ALIAS).filter(
+        pk__gte=start, pk__lt=start + settings.SITEMAP_SEGMENT_SIZE
+    ).order_by('pk').annotate(
+        last_comment=Subquery(last_comment)
+    ).values_list('pk', 'author__username', 'pub_date', 'last_comment')
+
+
+def build(root, number, version):
+    """Собирает XML части и сохраняет его под версией version."""
+    urls = [
+        (
+            root + reverse('post', args=[username, post_id]),
+            max(pub_date, last_comment or pub_date),
+        )
+        for post_id, username, pub_date, last_comment in entries(number)
+    ]
+    content = render_to_string('sitemaps/urlset.xml', {'urls': urls})
+
+    def store():
+        SitemapSegment.objects.filter(number=number).update(
+            root=root,
+            content=content,
+            lastmod=max((lastmod for _, lastmod in urls), default=None),
+            built_version=version,
+        )
+
+    try:
+        writes.write(store)
+    except writes.WriteBusy:
+        # Отдадим собранную часть и так, сохранит следующий запрос.
+        pass
+    return content
+
+
+def create(number):
+    """Заводит строку части до сборки, чтобы не потерять её пометки."""
+    def insert():
+        SitemapSegment.objects.bulk_create(
+            [SitemapSegment(number=number)], ignore_conflicts=True
+        )
+    writes.write(insert)
+
+
+@query_budget(5)
+def sitemap_segment(request, number):
+    segment = SitemapSegment.objects.filter(number=number).first()
+    # Ссылки в карте абсолютные: часть, собранную для другого хоста,
+    # собираем заново.
+    root = f'{request.scheme}://{request.get_host()}'
+    if segment is None:
+        newest = newest_segment()
+        if newest is None or number > newest:
+            raise Http404
+        try:
+            create(number)
+        except writes.WriteBusy:
+            pass
+        version = 0
+    elif segment.is_fresh and segment.root == root:
+        return HttpResponse(segment.content, content_type=CONTENT_TYPE)
+    else:
+        version = segment.version
+    content = build(root, number, version)
+    return HttpResponse(content, content_type=CONTENT_TYPE)
+
+
+@query_budget(2)
+def sitemap_index(request):
+    newest = newest_segment()
+    lastmods = {
+        number: lastmod
+        for number, lastmod in SitemapSegment.objects.filter(
+            built_version=F('version')
+        ).values_list('number', 'lastmod')
+    }
+    segments = [
+        (
+            request.build_absolute_uri(
+                reverse('sitemap_segment', args=[number])
+            ),
+            lastmods.get(number),
+        )
+        for number in range(0 if newest is None else newest + 1)
+    ]
+    content = render_to_string('sitemaps/index.xml', {'segments': segments})
+    return HttpResponse(content, content_type=CONTENT_TYPE)
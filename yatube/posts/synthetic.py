@@ -0,0 +1,207 @@
+"""Синтетические данные для нагрузочных прогонов.
+
+Всё случайное берётся из одного random.Random(seed), поэтому одинаковые
+параметры на пустой базе дают одинаковые данные. Активность и
+популярность пользователей распределены по степенному закону: немногие
+авторы пишут большую часть постов и собирают большинство подписчиков.
+Строки пишутся пачками bulk_create с заранее выданными id, чтобы не
+перечитывать их из базы.
+"""
+import io
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from .models import Comment, Follow, Group, Post, User
+
+WORDS = (
+    'утро вечер город река дорога дом окно кофе книга кино музыка друг '
+    'работа отпуск море горы лес снег дождь солнце поезд самолёт кот '
+    'собака сад рецепт ужин завтрак школа проект код релиз встреча '
+    'выставка концерт фото прогулка велосипед бег спорт новости идея '
+    'план мечта история вопрос ответ неделя выходные праздник подарок'
+).split()
+
+IMAGE_POOL_SIZE = 16
+
+
+def next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Generator:
+    def __init__(self, posts, users, groups, comments, follows,
+                 image_share, seed, end=None, alpha=1.2, days=365,
+                 chunk_size=1000, log=print):
+        self.counts = {
+            'posts': posts, 'users': max(users, 2), 'groups': groups
+        }
+        self.comments = comments
+        self.follows = follows
+        self.image_share = image_share
+        self.seed = seed
+        self.alpha = alpha
+        self.days = days
+        self.chunk_size = chunk_size
+        self.log = log
+        self.random = random.Random(seed)
+        # Даты отсчитываются от полуночи, а не от текущего момента, чтобы
+        # повторный запуск в тот же день дал те же данные.
+        self.now = end or timezone.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+    def run(self):
+        self.make_users()
+        self.make_groups()
+        self.make_images()
+        self.make_posts()
+        self.make_follows()
+
+    def insert(self, model, objects):
+        # Размер запроса Django подбирает сам под ограничения SQLite.
+        model.objects.bulk_create(objects)
+        objects.clear()
+
+    def pick_users(self, number):
+        """number id пользователей с весами по закону Ципфа."""
+        return self.random.choices(
+            self.user_ids, cum_weights=self.user_weights, k=number
+        )
+
+    def text(self, low, high):
+        words = self.random.choices(WORDS, k=self.random.randint(low, high))
+        return ' '.join(words).capitalize() + '.'
+
+    def make_users(self):
+        first = next_pk(User)
+        self.user_ids = list(range(first, first + self.counts['users']))
+        # Пользователь с меньшим id популярнее: вес 1 / ранг ** alpha.
+        self.user_weights = list(accumulate(
+            1 / rank ** self.alpha
+            for rank in range(1, len(self.user_ids) + 1)
+        ))
+        password = make_password(None)
+        users = []
+        for pk in self.user_ids:
+            users.append(User(
+                pk=pk, username=f'user{pk}', password=password,
+                first_name=self.random.choice(WORDS).capitalize(),
+                date_joined=self.now
+            ))
+            if len(users) >= self.chunk_size:
+                self.insert(User, users)
+        self.insert(User, users)
+        self.log(f'Пользователей: {len(self.user_ids)}')
+
+    def make_groups(self):
+        first = next_pk(Group)
+        self.group_ids = list(range(first, first + self.counts['groups']))
+        self.insert(Group, [
+            Group(
+                pk=pk, slug=f'group-{pk}',
+                title=self.text(1, 3).rstrip('.'),
+                description=self.text(5, 20)
+            )
+            for pk in self.group_ids
+        ])
+        self.log(f'Групп: {len(self.group_ids)}')
+
+    def make_images(self):
+        """Небольшой набор настоящих картинок, общих для многих постов."""
+        self.images = []
+        if not self.image_share:
+            return
+        for number in range(IMAGE_POOL_SIZE):
+            width = self.random.randint(480, 1600)
+            height = self.random.randint(320, 1200)
+            color = tuple(self.random.randrange(256) for _ in range(3))
+            content = io.BytesIO()
+            Image.new('RGB', (width, height), color).save(
+                content, format='JPEG', quality=70
+            )
+            name = default_storage.save(
+                f'posts/synthetic-{self.seed}-{number}.jpg',
+                ContentFile(content.getvalue())
+            )
+            self.images.append((name, width, height))
+
+    def make_posts(self):
+        post_pk = next_pk(Post)
+        comment_pk = next_pk(Comment)
+        posts, comments = [], []
+        total_comments = 0
+        for _ in range(self.counts['posts']):
+            author_id, = self.pick_users(1)
+            pub_date = self.now - timedelta(
+                seconds=self.random.uniform(0, self.days * 86400)
+            )
+            post = Post(
+                pk=post_pk, author_id=author_id, text=self.text(5, 80),
+                pub_date=pub_date, thumbnail_ready=False
+            )
+            if self.group_ids and self.random.random() < 0.7:
+                post.group_id = self.random.choice(self.group_ids)
+            if self.images and self.random.random() < self.image_share:
+                post.image, post.image_width, post.image_height = (
+                    self.random.choice(self.images)
+                )
+            posts.append(post)
+            for comment_author in self.pick_users(self.comment_number()):
+                comments.append(Comment(
+                    pk=comment_pk, post_id=post_pk,
+                    author_id=comment_author, text=self.text(2, 30),
+                    created=min(self.now, pub_date + timedelta(
+                        seconds=self.random.uniform(0, 2 * 86400)
+                    ))
+                ))
+                comment_pk += 1
+            post_pk += 1
+            if len(posts) >= self.chunk_size:
+                self.insert(Post, posts)
+            if len(comments) >= self.chunk_size:
+                total_comments += len(comments)
+                self.insert(Comment, comments)
+        self.insert(Post, posts)
+        total_comments += len(comments)
+        self.insert(Comment, comments)
+        self.log(
+            f'Постов: {self.counts["posts"]}, комментариев: {total_comments}'
+        )
+
+    def comment_number(self):
+        if not self.comments:
+            return 0
+        return int(self.random.expovariate(1 / self.comments))
+
+    def make_follows(self):
+        follows = []
+        total = 0
+        limit = len(self.user_ids) - 1
+        for user_id in self.user_ids:
+            # Парето с a = 1.5 в среднем даёт 3, отсюда деление на 3.
+            wanted = min(
+                limit,
+                int(self.random.paretovariate(1.5) * self.follows / 3)
+            )
+            authors = set()
+            for _ in range(wanted * 3):
+                if len(authors) >= wanted:
+                    break
+                author_id, = self.pick_users(1)
+                if author_id != user_id:
+                    authors.add(author_id)
+            for author_id in sorted(authors):
+                follows.append(Follow(user_id=user_id, author_id=author_id))
+            total += len(authors)
+            if len(follows) >= self.chunk_size:
+                self.insert(Follow, follows)
+        self.insert(Follow, follows)
+        self.log(f'Подписок: {total}')
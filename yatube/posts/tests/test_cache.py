@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+
+def tiered(location, max_entries=100):
+    return {
+        'BACKEND': 'yatube.cache.TieredCache',
+        'LOCATION': location,
+        'OPTIONS': {'L2': 'l2', 'MAX_ENTRIES': max_entries},
+    }
+
+
+class TieredCacheTests(SimpleTestCase):
+    """Два TieredCache с разными L1 ведут себя как два процесса."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        location = f'{self.directory}-'
+        override = override_settings(CACHES={
+            'default': settings.CACHES['default'],
+            'first': tiered(location + 'first', max_entries=2),
+            'second': tiered(location + 'second'),
+            'l2': {
+                'BACKEND': 'yatube.cache.SQLiteCache',
+                'LOCATION': os.path.join(self.directory, 'cache.sqlite3'),
+                'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_EVERY': 1},
+            },
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.first, self.second = caches['first'], caches['second']
+        self.first.clear()
+
+    def test_repeated_reads_stay_in_process(self):
+        self.first.set('key', 'value')
+        for _ in range(3):
+            self.assertEqual(self.first.get('key'), 'value')
+        stats = self.first.stats()
+        self.assertEqual(stats['l1']['hits'], 3)
+        self.assertEqual(stats['l2']['hits'], 0)
+
+    def test_write_invalidates_other_process(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.second.sync()
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.second.sync()
+        self.assertIsNone(self.second.get('key'))
+
+    def test_incr_is_shared(self):
+        self.first.set('generation', 1, None)
+        self.assertEqual(self.second.get('generation'), 1)
+        self.assertEqual(self.first.incr('generation'), 2)
+        self.second.sync()
+        self.assertEqual(self.second.get('generation'), 2)
+        with self.assertRaises(ValueError):
+            self.second.incr('missing')
+
+    def test_clear_reaches_other_process(self):
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.first.clear()
+        self.second.sync()
+        self.assertIsNone(self.second.get('key'))
+
+    def test_lru_evicts_least_recently_used(self):
+        self.first.set('a', 1)
+        self.first.set('b', 2)
+        self.first.get('a')
+        self.first.set('c', 3)
+        self.assertEqual(self.first.stats()['l1']['evictions'], 1)
+        self.assertEqual(
+            self.first.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2, 'c': 3}
+        )
+        stats = self.first.stats()
+        self.assertEqual(stats['l2']['hits'], 1)
+
+    def test_shared_store_evicts_soonest_expiring(self):
+        self.first.set('forever', 1, None)
+        self.first.set_many({f'key{i}': i for i in range(20)}, 60)
+        self.assertEqual(caches['l2'].get('forever'), 1)
+        self.assertGreater(self.first.stats()['l2']['evictions'], 0)
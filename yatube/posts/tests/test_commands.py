@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count, F
+from django.test import TestCase
+from posts import benchmarks
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry, User,
+                          UserStats)
+from posts.search import get_backend
+
+
+class NdjsonTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='Author')
+        self.reader = User.objects.create_user(username='Reader')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(
+            text='Старый пост', author=self.author, group=self.group
+        )
+        self.pub_date = datetime(2020, 5, 1, 12, 0, tzinfo=timezone.utc)
+        Post.objects.filter(pk=self.post.pk).update(pub_date=self.pub_date)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий'
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def export(self, **options):
+        fd, path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command(
+            'export_ndjson', output=path, stderr=StringIO(), **options
+        )
+        return path
+
+    def test_passwords_only_on_request(self):
+        with open(self.export(), encoding='utf-8') as stream:
+            self.assertNotIn('password', stream.read())
+        with open(self.export(with_passwords=True), encoding='utf-8') as f:
+            self.assertIn('"password"', f.read())
+
+    def test_round_trip(self):
+        """Выгрузка загружается в пустую базу без потерь."""
+        path = self.export()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        call_command('import_ndjson', path, stdout=StringIO())
+        post = Post.objects.get(text='Старый пост')
+        self.assertEqual(post.pk, self.post.pk)
+        self.assertEqual(post.pub_date, self.pub_date)
+        self.assertEqual(post.group.slug, 'group')
+        self.assertEqual(post.comment_count, 1)
+        reader = User.objects.get(username='Reader')
+        self.assertFalse(reader.has_usable_password())
+        self.assertEqual(UserStats.objects.get(user=reader).follows_count, 1)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=reader, post=post).exists()
+        )
+        self.assertEqual(len(get_backend().search('Старый', 10)), 1)
+
+    def test_import_is_idempotent(self):
+        path = self.export()
+        out = StringIO()
+        call_command('import_ndjson', path, stdout=out)
+        for label in ('user', 'group', 'post', 'comment', 'follow'):
+            self.assertIn(f'{label}: 0\n', out.getvalue())
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_unknown_author_rolls_back(self):
+        fd, path = tempfile.mkstemp(suffix='.ndjson')
+        with os.fdopen(fd, 'w') as stream:
+            stream.write(
+                '{"model": "group", "slug": "new", "title": "Новая", '
+                '"description": ""}\n'
+                '{"model": "post", "id": 100, "text": "Текст", '
+                '"pub_date": "2020-01-01T00:00:00Z", "author": "Nobody", '
+                '"group": "new", "image": ""}\n'
+            )
+        self.addCleanup(os.remove, path)
+        with self.assertRaises(CommandError):
+            call_command('import_ndjson', path, stdout=StringIO())
+        self.assertFalse(Group.objects.filter(slug='new').exists())
+
+    def test_taken_post_id_stops_import(self):
+        """Занятый чужим постом id не уводит комментарии под него."""
+        path = self.export()
+        Comment.objects.all().delete()
+        Post.objects.filter(pk=self.post.pk).update(text='Другой пост')
+        with self.assertRaisesMessage(CommandError, str(self.post.pk)):
+            call_command('import_ndjson', path, stdout=StringIO())
+        self.assertFalse(Comment.objects.exists())
+
+
+class GenerateDatasetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        settings.MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def generate(self, **options):
+        call_command(
+            'generate_dataset', posts=200, users=30, groups=5,
+            stdout=StringIO(), **options
+        )
+        return list(Post.objects.order_by('pk').values_list(
+            'text', 'author__username', 'pub_date'
+        ))
+
+    def test_scale_and_derived_data(self):
+        self.generate(seed=3)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(User.objects.count(), 30)
+        self.assertTrue(Post.objects.exclude(image='').exists())
+        self.assertTrue(Comment.objects.exists())
+        self.assertTrue(Follow.objects.exists())
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        busiest = Post.objects.values('author').annotate(
+            total=Count('pk')
+        ).order_by('-total').first()
+        stats = UserStats.objects.get(user_id=busiest['author'])
+        self.assertEqual(stats.posts_count, busiest['total'])
+
+    def test_same_seed_same_data(self):
+        first = self.generate(seed=5, images=0)
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.assertEqual(self.generate(seed=5, images=0)[:20], first[:20])
+
+
+class BenchmarkTests(TestCase):
+    def test_every_route_is_measured(self):
+        """Для каждого маршрута находятся значения всех параметров."""
+        author = User.objects.create_user(username='Author')
+        reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=reader, author=author)
+        Group.objects.create(title='Группа', slug='group')
+        for user in (author, reader):
+            Post.objects.create(text='Пост', author=user)
+        names = [name for name, _ in benchmarks.routes()]
+        self.assertIn('sitemap_segment', names)
+        self.assertIn('site_feed', names)
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_probe_counts_queries_and_rows(self):
+        User.objects.create_user(username='First')
+        User.objects.create_user(username='Second')
+        probe = benchmarks.DatabaseProbe()
+        with probe.counting():
+            list(User.objects.all())
+        self.assertEqual((probe.queries, probe.rows), (1, 2))
+
+    def test_caches_are_isolated(self):
+        """Замеры не пишут в кэш сайта."""
+        directory = tempfile.gettempdir()
+        isolated = benchmarks.isolated_caches(directory)
+        for alias, params in settings.CACHES.items():
+            with self.subTest(alias=alias):
+                self.assertNotEqual(
+                    isolated[alias].get('LOCATION'), params.get('LOCATION')
+                )
+        self.assertEqual(
+            os.path.dirname(isolated['shared']['LOCATION']), directory
+        )
+
+    def test_compare_flags_only_real_regressions(self):
+        baseline = {'index': {'p50_ms': 10.0, 'queries': 3, 'rows': 10}}
+        results = {'index': {
+            'p50_ms': 13.0, 'p95_ms': 20.0, 'p99_ms': 30.0,
+            'queries': 4, 'rows': 10, 'peak_kb': 100.0,
+        }}
+        _, regressions = benchmarks.compare(
+            results, baseline, threshold=0.2, min_delta_ms=5
+        )
+        self.assertEqual(regressions, ['index.queries'])
@@ -1,12 +1,22 @@
+import io
 import shutil
 import tempfile
+from unittest import mock
 
 from django.conf import settings
+from django.core.cache import cache, caches
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from posts import thumbnails
 from posts.forms import PostForm
 from posts.models import Group, Post, User
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.helpers import serialize
+from sorl.thumbnail.models import KVStore
 
 
 class PostFormTests(TestCase):
@@ -90,3 +100,177 @@ class PostFormTests(TestCase):
                 text='Новый текст'
             ).exists()
         )
+
+
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # override_settings, а не присваивание: только он сбрасывает
+        # каталог, запомненный default_storage.
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        cls.user = User.objects.create_user(username='Test')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        caches['thumbnails'].clear()
+        self.small_gif = small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x01\x00'
+            b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+            b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+            b'\x00\x00\x01\x00\x01\x00\x00\x02'
+            b'\x02\x4c\x01\x00\x3b'
+        )
+        self.post = Post.objects.create(
+            text='Текст',
+            author=self.user,
+            image=SimpleUploadedFile('thumb.gif', small_gif, 'image/gif')
+        )
+
+    def test_original_image_until_thumbnail_is_ready(self):
+        """Пока миниатюры нет, карточка показывает исходную картинку."""
+        self.assertFalse(self.post.thumbnail_ready)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, f'src="{self.post.image.url}"')
+
+    def test_generate_marks_post_ready(self):
+        with mock.patch('posts.thumbnails.get_thumbnail') as get_thumbnail:
+            thumbnails.generate(self.post.id)
+        for geometry, options in thumbnails.GEOMETRIES:
+            get_thumbnail.assert_any_call(mock.ANY, geometry, **options)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertTrue(post.thumbnail_ready)
+        self.assertEqual(post.version, self.post.version + 1)
+
+    def test_page_reads_thumbnails_in_one_query(self):
+        """Миниатюры всей страницы читаются из базы одним запросом."""
+        posts = [self.post] + [
+            Post.objects.create(
+                text='Текст',
+                author=self.user,
+                image=SimpleUploadedFile(
+                    f'thumb{number}.gif', self.small_gif, 'image/gif'
+                )
+            )
+            for number in range(2)
+        ]
+        storage = default.storage.__class__.__module__ + '.' + (
+            default.storage.__class__.__name__
+        )
+        geometry, options = thumbnails.GEOMETRIES[0]
+        for post in posts:
+            KVStore.objects.create(
+                key=thumbnails.thumbnail_key(post.image, geometry, options),
+                value=serialize({
+                    'name': f'cache/thumb-{post.pk}.gif',
+                    'storage': storage,
+                    'size': [960, 339],
+                })
+            )
+        Post.objects.update(thumbnail_ready=True)
+        caches['thumbnails'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        for post in posts:
+            self.assertContains(response, f'cache/thumb-{post.pk}.gif')
+        kvstore_queries = [
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+
+
+def make_jpeg(width, height, orientation=None):
+    image = Image.new('RGB', (width, height), 'red')
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    content = io.BytesIO()
+    image.save(content, format='JPEG', exif=exif.tobytes())
+    return SimpleUploadedFile(
+        name='photo.jpg',
+        content=content.getvalue(),
+        content_type='image/jpeg'
+    )
+
+
+class ImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        cls.user = User.objects.create_user(username='Test')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_upload_is_rotated_and_downscaled(self):
+        """Картинка поворачивается по EXIF, уменьшается и теряет EXIF."""
+        # Ориентация 6: снимок нужно повернуть на 90° по часовой.
+        uploaded = make_jpeg(400, 200, orientation=6)
+        self.authorized_client.post(
+            reverse('new_post'),
+            data={'text': 'Фото', 'image': uploaded}
+        )
+        post = Post.objects.get(text='Фото')
+        self.assertEqual((post.image_width, post.image_height), (50, 100))
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (50, 100))
+            self.assertEqual(len(stored.getexif()), 0)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_animation_keeps_first_frame_without_exif(self):
+        """Анимация уменьшается до первого кадра и теряет EXIF."""
+        frames = [Image.new('RGB', (400, 200), color) for color in (
+            'red', 'blue'
+        )]
+        exif = Image.Exif()
+        exif[0x8825] = {2: (55.0, 45.0, 0.0)}
+        content = io.BytesIO()
+        frames[0].save(
+            content, format='GIF', save_all=True, append_images=frames[1:],
+            exif=exif.tobytes()
+        )
+        self.authorized_client.post(reverse('new_post'), data={
+            'text': 'Анимация',
+            'image': SimpleUploadedFile(
+                'anim.gif', content.getvalue(), content_type='image/gif'
+            ),
+        })
+        post = Post.objects.get(text='Анимация')
+        self.assertEqual((post.image_width, post.image_height), (100, 50))
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (100, 50))
+            self.assertFalse(getattr(stored, 'is_animated', False))
+            self.assertEqual(len(stored.getexif()), 0)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels_rejected(self):
+        """Картинка больше лимита пикселей не сохраняется."""
+        response = self.authorized_client.post(
+            reverse('new_post'),
+            data={'text': 'Фото', 'image': make_jpeg(20, 20)}
+        )
+        self.assertFalse(Post.objects.filter(text='Фото').exists())
+        self.assertFormError(
+            response, 'form', 'image',
+            'Картинка 20×20 слишком большая, допустимо до 100 пикселей'
+        )
@@ -1,5 +1,8 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
-from posts.models import Group, Post, User
+from posts.models import Comment, Follow, Group, Post, User, UserStats
 
 
 class GroupModelTest(TestCase):
@@ -40,3 +43,47 @@ class PostModelTest(TestCase):
         post = PostModelTest.post
         expected_str = post.text[:15]
         self.assertEqual(expected_str, str(post))
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются вместе с записями, комментариями, подписками."""
+        post = Post.objects.create(text='Текст', author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        author_stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 1)
+        self.assertEqual(UserStats.for_user(self.reader).follows_count, 1)
+        follow.delete()
+        post.comments.all().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+        self.assertEqual(UserStats.for_user(self.reader).follows_count, 0)
+
+    def test_edit_keeps_comment_count(self):
+        """Правка поста не затирает счётчик устаревшим значением."""
+        post = Post.objects.create(text='Текст', author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        post.text = 'Новый текст'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+    def test_recount_counters_fixes_drift(self):
+        post = Post.objects.create(text='Текст', author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Post.objects.filter(pk=post.pk).update(comment_count=7)
+        UserStats.objects.filter(user=self.author).update(posts_count=0)
+        call_command('recount_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(UserStats.for_user(self.author).posts_count, 1)
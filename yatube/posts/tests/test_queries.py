@@ -0,0 +1,228 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, resolve, reverse
+from posts import urls
+from posts.models import Comment, Follow, Group, Post, User
+from posts.paginators import NEXT, encode_cursor
+
+SIZES = (1, 10, 100)
+# Маршруты, которые нельзя открыть по их адресу: /404/ и /500/
+# перехватывает профиль пользователя.
+UNREACHABLE = ('page_not_found', 'server_error')
+
+
+def read(response):
+    """Дочитывает потоковый ответ: его запросы идут при чтении."""
+    if response.streaming:
+        b''.join(response.streaming_content)
+
+
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def fill(self, size):
+        Post.objects.all().delete()
+        Follow.objects.get_or_create(user=self.reader, author=self.author)
+        for i in range(size):
+            post = Post.objects.create(
+                text=f'Текст{i}', author=self.author, group=self.group
+            )
+            Comment.objects.create(post=post, author=self.reader, text='Ок')
+        return post
+
+    def routes(self, post):
+        """URL и клиент для каждого маршрута posts.urls."""
+        on_post = {'username': 'Author', 'post_id': post.id}
+        return {
+            'index': (reverse('index'), self.reader_client),
+            'group': (
+                reverse('group', kwargs={'slug': 'group'}),
+                self.reader_client
+            ),
+            'new_post': (reverse('new_post'), self.author_client),
+            'follow_index': (reverse('follow_index'), self.reader_client),
+            'search': (reverse('search') + '?q=Текст', self.reader_client),
+            'profile': (
+                reverse('profile', kwargs={'username': 'Author'}),
+                self.reader_client
+            ),
+            'post': (reverse('post', kwargs=on_post), self.reader_client),
+            'post_comments': (
+                reverse('post_comments', kwargs=on_post), self.reader_client
+            ),
+            'post_edit': (
+                reverse('post_edit', kwargs=on_post), self.author_client
+            ),
+            'add_comment': (
+                reverse('add_comment', kwargs=on_post), self.reader_client
+            ),
+            'profile_follow': (
+                reverse('profile_follow', kwargs={'username': 'Author'}),
+                self.reader_client
+            ),
+            'profile_unfollow': (
+                reverse('profile_unfollow', kwargs={'username': 'Author'}),
+                self.reader_client
+            ),
+            'sitemap_index': (reverse('sitemap_index'), self.reader_client),
+            'sitemap_segment': (
+                reverse('sitemap_segment', args=[0]), self.reader_client
+            ),
+            'site_feed': (
+                reverse('site_feed', args=['atom']), self.reader_client
+            ),
+            'group_feed': (
+                reverse('group_feed', args=['group', 'rss']),
+                self.reader_client
+            ),
+            'author_feed': (
+                reverse('author_feed', args=['Author', 'atom']),
+                self.reader_client
+            ),
+        }
+
+    def test_every_view_has_budget(self):
+        for pattern in urls.urlpatterns:
+            if isinstance(pattern, URLPattern):
+                with self.subTest(name=pattern.name):
+                    self.assertTrue(
+                        hasattr(pattern.callback, 'query_budget'),
+                        f'Задайте @query_budget для {pattern.name}'
+                    )
+
+    # Иначе страница обрезается до 10 постов и 100 не проверяются.
+    @override_settings(
+        NUMBER_OF_BLOCKS=max(SIZES),
+        COMMENTS_PER_PAGE=max(SIZES),
+        FEED_SIZE=max(SIZES),
+    )
+    def test_views_fit_budget(self):
+        names = {
+            pattern.name for pattern in urls.urlpatterns
+        } - set(UNREACHABLE)
+        for size in SIZES:
+            post = self.fill(size)
+            routes = self.routes(post)
+            self.assertEqual(set(routes), names)
+            for name, (url, client) in routes.items():
+                with self.subTest(name=name, size=size):
+                    cache.clear()
+                    budget = resolve(url.split('?')[0]).func.query_budget
+                    with CaptureQueriesContext(connection) as queries:
+                        response = client.get(url)
+                        read(response)
+                    self.assertLess(response.status_code, 400)
+                    self.assertLessEqual(
+                        len(queries), budget,
+                        f'{url} при {size} постах: '
+                        + '\n'.join(q['sql'] for q in queries)
+                    )
+
+
+class QueryPlanTests(TestCase):
+    """Запросы лент и комментариев идут по индексам, без сортировки."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(3):
+            cls.post = Post.objects.create(
+                text=f'Текст{i}', author=cls.author, group=cls.group
+            )
+            Comment.objects.create(
+                post=cls.post, author=cls.reader, text='Ок'
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def plans(self, url):
+        """Планы всех SELECT, которые выполнил view по адресу url."""
+        statements = []
+
+        def collect(execute, sql, params, many, context):
+            if sql.startswith('SELECT'):
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(collect):
+            response = self.client.get(url)
+            read(response)
+        self.assertEqual(response.status_code, 200)
+        with connection.cursor() as cursor:
+            for sql, params in statements:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                yield sql, [row[-1] for row in cursor.fetchall()]
+
+    def test_feeds_use_indexes(self):
+        pages = {
+            'index': reverse('index'),
+            'group': reverse('group', kwargs={'slug': 'group'}),
+            'profile': reverse('profile', kwargs={'username': 'Author'}),
+            'post': reverse('post', kwargs={
+                'username': 'Author', 'post_id': self.post.id}),
+            'post_comments': reverse('post_comments', kwargs={
+                'username': 'Author', 'post_id': self.post.id}),
+            'follow_index': reverse('follow_index'),
+        }
+        # Вторая страница: курсор добавляет условие по дате и id.
+        cursor = encode_cursor(NEXT, self.post.pub_date, self.post.pk)
+        comment = self.post.comments.get()
+        comment_cursor = encode_cursor(NEXT, comment.created, comment.pk)
+        pages.update({
+            f'{name}:cursor': '{}?cursor={}'.format(
+                url, comment_cursor if name.startswith('post') else cursor
+            )
+            for name, url in pages.items()
+        })
+        pages.update({
+            'site_feed': reverse('site_feed', args=['atom']),
+            'group_feed': reverse('group_feed', args=['group', 'rss']),
+            'author_feed': reverse('author_feed', args=['Author', 'atom']),
+            'sitemap_segment': reverse('sitemap_segment', args=[0]),
+        })
+        self.assert_indexed(pages)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_loud_authors_use_indexes(self):
+        """Посты громких авторов подмешиваются в ленту без сортировки."""
+        cursor = encode_cursor(NEXT, self.post.pub_date, self.post.pk)
+        self.assert_indexed({
+            'follow_index': reverse('follow_index'),
+            'follow_index:cursor': '{}?cursor={}'.format(
+                reverse('follow_index'), cursor
+            ),
+        })
+
+    def assert_indexed(self, pages):
+        for name, url in pages.items():
+            for sql, plan in self.plans(url):
+                with self.subTest(name=name, sql=sql):
+                    for step in plan:
+                        self.assertFalse(
+                            step.startswith('SCAN') and 'INDEX' not in step,
+                            f'Полный просмотр таблицы: {plan}'
+                        )
+                        self.assertNotIn(
+                            'TEMP B-TREE', step,
+                            f'Сортировка без индекса: {plan}'
+                        )
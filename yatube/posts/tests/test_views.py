@@ -1,14 +1,26 @@
+import os
 import shutil
 import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.core.cache import cache, caches
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
-from posts.models import Follow, Group, Post
+from posts import coalescing, profiling, routers, timeline, writes
+from posts.caching import get_generation, group_scope, profile_scope
+from posts.models import (Comment, Follow, Group, Post, SitemapSegment,
+                          TimelineEntry, UserStats)
 
 User = get_user_model()
 
@@ -177,9 +189,44 @@ class PaginatorViewsTest(TestCase):
         self.assertEqual(len(response.context['page']), 10)
 
     def test_second_page_contains_three_records(self):
-        response = self.client.get(reverse('index') + '?page=2')
+        response = self.client.get(reverse('index') + '?page=2', follow=True)
         self.assertEqual(len(response.context['page']), 3)
 
+    def test_legacy_page_redirects_to_cursor(self):
+        """Старая ссылка ?page=N ведёт на курсорную страницу."""
+        response = self.client.get(reverse('index') + '?page=2')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('?cursor=', response.url)
+        response = self.client.get(reverse('index') + '?page=1')
+        self.assertRedirects(response, reverse('index'))
+
+    def test_cursor_navigation_walks_whole_feed(self):
+        """Курсоры вперёд и назад обходят ленту без пропусков."""
+        first = self.client.get(reverse('index')).context['page']
+        self.assertFalse(first.has_previous())
+        self.assertTrue(first.has_next())
+        second = self.client.get(
+            reverse('index') + f'?cursor={first.next_cursor}'
+        ).context['page']
+        self.assertFalse(second.has_next())
+        ids = [post.id for post in first] + [post.id for post in second]
+        expected = list(
+            Post.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        back = self.client.get(
+            reverse('index') + f'?cursor={second.previous_cursor}'
+        ).context['page']
+        self.assertEqual(
+            [post.id for post in back], [post.id for post in first]
+        )
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.client.get(reverse('index') + '?cursor=%%%')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 10)
+
 
 class NewPostGroupTests(TestCase):
     @classmethod
@@ -370,12 +417,855 @@ class CacheTests(TestCase):
     def test_cache(self):
         response = self.authorized_client.get(reverse('index'))
         post_content = response.content
+        response = self.authorized_client.get(reverse('index'))
+        self.assertIsNone(response.context)
+        self.assertEqual(post_content, response.content)
         Post.objects.create(
             text='Second' * 10,
             author=self.user
         )
         response = self.authorized_client.get(reverse('index'))
-        self.assertEqual(post_content, response.content)
-        cache.clear()
-        response = self.authorized_client.get(reverse('index'))
         self.assertNotEqual(post_content, response.content)
+        self.assertContains(response, 'Second')
+
+    def test_comment_refreshes_cached_pages(self):
+        """Комментарий сразу виден на закэшированных страницах."""
+        urls = [
+            reverse('index'),
+            reverse('profile', kwargs={'username': self.user.username}),
+        ]
+        for url in urls:
+            self.authorized_client.get(url)
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertContains(response, 'Комментариев: 1')
+
+    def test_cached_page_does_not_write_shared_cache(self):
+        """Попадание в кэш страницы ничего не пишет в общий кэш."""
+        Group.objects.create(title='Группа', slug='group')
+        urls = [
+            reverse('index'),
+            reverse('group', kwargs={'slug': 'group'}),
+            reverse('profile', kwargs={'username': self.user.username}),
+        ]
+        for url in urls:
+            self.client.get(url)
+        shared = caches['shared']
+        for url in urls:
+            with self.subTest(url=url), \
+                    mock.patch.object(shared, 'add') as add, \
+                    mock.patch.object(shared, 'set') as set_:
+                self.client.get(url)
+                add.assert_not_called()
+                set_.assert_not_called()
+
+    def test_missing_pages_leave_no_generation(self):
+        """Адреса несуществующих групп и авторов не заводят поколений."""
+        pages = {
+            group_scope('nosuch'): [
+                reverse('group', kwargs={'slug': 'nosuch'}),
+                reverse('group_feed', args=['nosuch', 'rss']),
+            ],
+            profile_scope('nosuchuser'): [
+                reverse('profile', kwargs={'username': 'nosuchuser'}),
+                reverse('author_feed', args=['nosuchuser', 'atom']),
+            ],
+        }
+        for scope, urls in pages.items():
+            for url in urls:
+                with self.subTest(url=url):
+                    self.assertEqual(self.client.get(url).status_code, 404)
+                    self.assertIsNone(get_generation(scope, create=False))
+
+    def test_pages_are_not_shared_between_users(self):
+        self.authorized_client.get(reverse('index'))
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'Пользователь: Test')
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.follower = User.objects.create_user(username='Follower')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.follower)
+
+    def feed(self):
+        response = self.authorized_client.get(reverse('follow_index'))
+        return [post.id for post in response.context['page']]
+
+    def test_new_post_lands_in_timeline(self):
+        """Пост автора раскладывается подписчику при публикации."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        post = Post.objects.create(text='Текст', author=self.author)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.follower, post=post)
+        )
+        self.assertEqual(self.feed(), [post.id])
+
+    @override_settings(TIMELINE_DEPTH=2)
+    def test_follow_backfills_limited_depth(self):
+        """Подписка подтягивает не больше TIMELINE_DEPTH постов."""
+        for i in range(3):
+            Post.objects.create(text=f'Текст{i}', author=self.author)
+        self.authorized_client.get(
+            reverse('profile_follow', kwargs={'username': 'Author'})
+        )
+        self.assertEqual(self.follower.timeline.count(), 2)
+        self.authorized_client.get(
+            reverse('profile_unfollow', kwargs={'username': 'Author'})
+        )
+        self.assertEqual(self.follower.timeline.count(), 0)
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_loud_author_is_read_on_request(self):
+        """Посты авторов с огромной аудиторией читаются без раскладки."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        post = Post.objects.create(text='Текст', author=self.author)
+        self.assertFalse(self.follower.timeline.exists())
+        self.assertEqual(self.feed(), [post.id])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1, NUMBER_OF_BLOCKS=2)
+    def test_loud_and_fanned_out_posts_are_paged_together(self):
+        """Посты из ленты и громких авторов идут по дате через страницы."""
+        quiet = User.objects.create_user(username='Quiet')
+        other = User.objects.create_user(username='Other')
+        for user in (self.follower, other):
+            Follow.objects.create(user=user, author=self.author)
+        Follow.objects.create(user=self.follower, author=quiet)
+        posts = [
+            Post.objects.create(text=f'Текст{i}', author=author)
+            for i, author in enumerate([self.author, quiet] * 3)
+        ]
+        self.assertEqual(self.follower.timeline.count(), 3)
+        url = reverse('follow_index')
+        pages = []
+        while url:
+            page = self.authorized_client.get(url).context['page']
+            pages.append([post.id for post in page])
+            url = page.has_next() and '{}?cursor={}'.format(
+                reverse('follow_index'), page.next_cursor
+            )
+        newest_first = [post.id for post in reversed(posts)]
+        self.assertEqual(pages, [
+            newest_first[:2], newest_first[2:4], newest_first[4:]
+        ])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_author_back_under_limit_is_fanned_out(self):
+        """Автора, опустившегося до порога, раскладывает команда."""
+        other = User.objects.create_user(username='Other')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        post = Post.objects.create(text='Текст', author=self.author)
+        self.assertFalse(self.follower.timeline.exists())
+        self.assertEqual(self.feed(), [post.id])
+        Follow.objects.filter(user=other).delete()
+        # Отписка не пишет в чужие ленты: до команды автор читается
+        # как громкий. Кэш чистим, чтобы страница собиралась заново.
+        self.assertFalse(self.follower.timeline.exists())
+        cache.clear()
+        self.assertEqual(self.feed(), [post.id])
+        call_command('resume_fan_out', stdout=StringIO())
+        self.assertTrue(self.follower.timeline.filter(post=post).exists())
+        self.assertEqual(UserStats.for_user(self.author).pending_fan_outs, 0)
+        cache.clear()
+        self.assertEqual(self.feed(), [post.id])
+
+    @override_settings(TIMELINE_DEPTH=1)
+    def test_publishing_caps_depth(self):
+        """Публикация подрезает ленту, переросшую глубину с запасом."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        for i in range(timeline.TRIM_SLACK + 1):
+            Post.objects.create(text=f'Текст{i}', author=self.author)
+        self.assertEqual(
+            self.follower.timeline.count(), timeline.TRIM_SLACK + 1
+        )
+        Post.objects.create(text='Ещё', author=self.author)
+        self.assertEqual(self.follower.timeline.count(), 1)
+
+
+class PostCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Author')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(
+            text='Старый текст', author=self.user, group=self.group
+        )
+        self.url = reverse('group', kwargs={'slug': 'group'})
+
+    def test_card_is_reused_until_version_changes(self):
+        """Карточка берётся из кэша, пока не изменится версия поста."""
+        self.client.get(self.url)
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        self.assertContains(self.client.get(self.url), 'Старый текст')
+        self.post.text = 'Новый текст'
+        self.post.save()
+        self.assertContains(self.client.get(self.url), 'Новый текст')
+
+    def test_group_and_author_renames_change_card(self):
+        self.client.get(self.url)
+        self.client.get(reverse('index'))
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertContains(self.client.get(self.url), 'Новое название')
+        self.user.username = 'Renamed'
+        self.user.save()
+        for url in (self.url, reverse('index')):
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), '@Renamed')
+
+    def test_renames_reach_cached_follow_feed(self):
+        """Лента подписок видит новое название группы и имя автора."""
+        reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=reader, author=self.user)
+        client = Client()
+        client.force_login(reader)
+        url = reverse('follow_index')
+        client.get(url)
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertContains(client.get(url), 'Новое название')
+        self.user.username = 'Renamed'
+        self.user.save()
+        self.assertContains(client.get(url), '@Renamed')
+
+    def read(self, url):
+        """Код ответа и тело; ленту дочитываем, иначе она не в кэше."""
+        response = self.client.get(url)
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        return response.status_code, content.decode()
+
+    def test_full_name_change_refreshes_profile_and_feed(self):
+        urls = [
+            reverse('profile', kwargs={'username': 'Author'}),
+            reverse('author_feed', args=['Author', 'atom']),
+        ]
+        for url in urls:
+            self.read(url)
+        self.user.first_name, self.user.last_name = 'Лев', 'Толстой'
+        self.user.save()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertIn('Лев Толстой', self.read(url)[1])
+
+    def test_deleted_group_pages_are_dropped(self):
+        urls = [self.url, reverse('group_feed', args=['group', 'rss'])]
+        for url in urls:
+            self.read(url)
+        self.client.get(reverse('index'))
+        self.group.delete()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.read(url)[0], 404)
+        self.assertNotContains(self.client.get(reverse('index')), '#Группа')
+
+    def test_comment_changes_card(self):
+        self.client.get(self.url)
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        self.assertContains(self.client.get(self.url), 'Комментариев: 1')
+
+    def test_edit_link_is_not_cached(self):
+        """Ссылка «Редактировать» видна только автору даже из кэша."""
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(self.url), 'Редактировать')
+        self.client.logout()
+        self.assertNotContains(self.client.get(self.url), 'Редактировать')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Author')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(
+            text='Текст', author=self.user, group=self.group
+        )
+        self.urls = [
+            reverse('group', kwargs={'slug': 'group'}),
+            reverse('profile', kwargs={'username': 'Author'}),
+            reverse('post', kwargs={
+                'username': 'Author', 'post_id': self.post.id}),
+        ]
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_page_is_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+    def test_comment_changes_validator(self):
+        """Комментарий меняет метку всех страниц с карточкой поста."""
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        Comment.objects.create(post=self.post, author=self.user, text='Ок')
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_validator_depends_on_user(self):
+        url = self.urls[2]
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.user)
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_validator_depends_on_csrf_token(self):
+        """После нового входа 304 не оставляет у клиента старый токен CSRF."""
+        url = self.urls[2]
+        self.user.set_password('secret')
+        self.user.save()
+        credentials = {'username': 'Author', 'password': 'secret'}
+        # force_login() не меняет cookie CSRF, вход через форму меняет.
+        self.client.post(reverse('login'), credentials)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+        self.client.logout()
+        self.client.post(reverse('login'), credentials)
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+
+class FollowFeedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.stranger = User.objects.create_user(username='Stranger')
+        self.reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def get_feed(self):
+        return self.authorized_client.get(reverse('follow_index'))
+
+    def test_feed_is_cached_until_followed_author_posts(self):
+        """Ленту сбрасывает только пост автора из подписок."""
+        self.get_feed()
+        Post.objects.create(text='Чужой', author=self.stranger)
+        self.assertIsNone(self.get_feed().context)
+        Post.objects.create(text='Свежий', author=self.author)
+        response = self.get_feed()
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Свежий')
+
+    def test_follow_resets_feed(self):
+        Post.objects.create(text='Чужой', author=self.stranger)
+        self.get_feed()
+        self.authorized_client.get(
+            reverse('profile_follow', kwargs={'username': 'Stranger'})
+        )
+        self.assertContains(self.get_feed(), 'Чужой')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Author')
+        cls.post = Post.objects.create(
+            text='Рецепт <b>борща</b> со сметаной', author=cls.user
+        )
+        cls.other = Post.objects.create(text='Про котов', author=cls.user)
+        cls.comment = Comment.objects.create(
+            post=cls.other, author=cls.user, text='Коты любят сметану'
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse('search'), {'q': query})
+        return response.context['results']
+
+    def test_finds_posts_and_comments(self):
+        """Поиск находит посты и комментарии, выделяя совпадения."""
+        results = self.search('сметаной')
+        self.assertEqual([r['post'] for r in results], [self.post])
+        self.assertIn('<mark>сметаной</mark>', results[0]['hit'].snippet)
+        self.assertIn('&lt;b&gt;', results[0]['hit'].snippet)
+        results = self.search('сметану')
+        self.assertEqual(results[0]['hit'].comment_id, self.comment.id)
+
+    def test_index_follows_edits_and_deletes(self):
+        self.post.text = 'Рецепт щей'
+        self.post.save()
+        self.assertEqual(self.search('борща'), [])
+        self.assertEqual(len(self.search('щей')), 1)
+        self.comment.delete()
+        self.assertEqual(self.search('сметану'), [])
+
+    def test_query_operators_are_plain_words(self):
+        response = self.client.get(reverse('search'), {'q': 'NEAR( "* OR'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_control_characters_are_separators(self):
+        self.assertEqual(len(self.search('сметаной\x00')), 1)
+        self.assertEqual(self.search('\x00\x02'), [])
+
+
+@override_settings(REQUEST_PROFILING=True)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profiling.reset()
+        self.user = User.objects.create_user(username='Author')
+        Post.objects.create(text='Текст', author=self.user)
+        self.staff = User.objects.create_user(username='Staff', is_staff=True)
+        # Middleware читает настройку при создании обработчика клиента.
+        self.client = Client()
+
+    def test_response_has_server_timing(self):
+        response = self.client.get(
+            reverse('profile', kwargs={'username': 'Author'})
+        )
+        timing = response['Server-Timing']
+        for phase in ('view;dur=', 'db;dur=', 'tpl;dur=', 'cache;desc='):
+            self.assertIn(phase, timing)
+        self.assertNotIn('db;dur=0.0;desc="0 queries"', timing)
+
+    def test_stats_are_grouped_by_route(self):
+        for _ in range(3):
+            self.client.get(reverse('index'))
+        self.client.force_login(self.staff)
+        stats = self.client.get(reverse('request_stats')).json()
+        index = stats['routes']['index']
+        self.assertEqual(index['count'], 3)
+        self.assertEqual(sum(index['histogram']), 3)
+        self.assertEqual(
+            len(index['histogram']), len(stats['buckets_ms']) + 1
+        )
+
+    def test_every_database_is_recorded(self):
+        recorder = profiling.Recorder()
+        with profiling.recording(recorder):
+            for alias in connections:
+                with self.subTest(alias=alias):
+                    self.assertIn(
+                        recorder, connections[alias].execute_wrappers
+                    )
+
+    def test_streaming_response_is_recorded_when_read(self):
+        response = self.client.get(reverse('site_feed', args=['atom']))
+        self.assertIn('stream;desc="partial"', response['Server-Timing'])
+        self.assertNotIn('site_feed', profiling.snapshot()['routes'])
+        b''.join(response.streaming_content)
+        response.close()
+        stats = profiling.snapshot()['routes']['site_feed']
+        self.assertEqual(stats['count'], 1)
+        self.assertGreater(stats['queries'], 0)
+
+    def test_stats_are_for_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('request_stats'))
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled_middleware_is_skipped(self):
+        response = Client().get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(profiling.snapshot()['routes'], {})
+
+
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Author')
+        self.client.force_login(self.user)
+
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            for pragma, value in (
+                ('busy_timeout', 5000),
+                ('synchronous', 1),
+                ('cache_size', -64 * 1024),
+            ):
+                with self.subTest(pragma=pragma):
+                    cursor.execute(f'PRAGMA {pragma}')
+                    self.assertEqual(cursor.fetchone()[0], value)
+
+    @override_settings(WRITE_RETRY_DELAY=0)
+    def test_locked_write_is_retried(self):
+        attempts = []
+
+        def flaky():
+            attempts.append(connection.in_atomic_block)
+            if len(attempts) < 3:
+                raise OperationalError('database is locked')
+            return 'ok'
+
+        self.assertEqual(writes.write(flaky), 'ok')
+        self.assertEqual(attempts, [True, True, True])
+
+    @override_settings(WRITE_RETRIES=1, WRITE_RETRY_DELAY=0)
+    def test_busy_database_keeps_form(self):
+        """Перегруженная база — 503 и форма с текстом, а не ошибка 500."""
+        with mock.patch.object(
+            Post, 'save', side_effect=OperationalError('database is locked')
+        ):
+            response = self.client.post(
+                reverse('new_post'), {'text': 'Не потеряется'}
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, writes.BUSY_MESSAGE, status_code=503)
+        self.assertContains(response, 'Не потеряется', status_code=503)
+        self.assertFalse(Post.objects.exists())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTests(TransactionTestCase):
+    """Реплика — второй файл SQLite, который копирует sync_replicas."""
+
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        connections.databases['replica'] = {
+            **connections.databases['default'],
+            'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Author')
+        self.post = Post.objects.create(text='Старый пост', author=self.user)
+        call_command('sync_replicas', stdout=StringIO())
+        self.client.force_login(self.user)
+
+    def post_url(self, post):
+        return reverse('post', kwargs={
+            'username': 'Author', 'post_id': post.id})
+
+    def test_reads_see_replica_until_sync(self):
+        post = Post.objects.create(text='Новый пост', author=self.user)
+        self.assertEqual(self.client.get(self.post_url(post)).status_code, 404)
+        call_command('sync_replicas', stdout=StringIO())
+        self.assertEqual(self.client.get(self.post_url(post)).status_code, 200)
+
+    def test_own_write_is_read_from_primary(self):
+        response = self.client.post(reverse('new_post'), {'text': 'Мой пост'})
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        post = Post.objects.get(text='Мой пост')
+        self.assertEqual(self.client.get(self.post_url(post)).status_code, 200)
+        stranger = Client()
+        self.assertEqual(stranger.get(self.post_url(post)).status_code, 404)
+
+    # Страница с реплики живёт в кэше не дольше REPLICA_LAG.
+    @override_settings(REPLICA_LAG=0)
+    def test_replica_page_has_no_generation_etag(self):
+        """Страница с отстающей реплики не получает метку поколения."""
+        group = Group.objects.create(title='Группа', slug='group')
+        call_command('sync_replicas', stdout=StringIO())
+        Post.objects.create(text='Новый пост', author=self.user, group=group)
+        reader = Client()
+        url = reverse('group', kwargs={'slug': 'group'})
+        response = reader.get(url)
+        self.assertNotContains(response, 'Новый пост')
+        self.assertFalse(response.has_header('ETag'))
+        call_command('sync_replicas', stdout=StringIO())
+        # Метка, которую страница получила бы до исправления.
+        etag = f'"None.{get_generation(group_scope("group"))}"'
+        response = reader.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Новый пост')
+
+    @override_settings(REPLICA_LAG=0)
+    def test_replica_feed_has_no_etag(self):
+        """Лента с реплики тоже не получает метку поколения."""
+        Post.objects.create(text='Новый пост', author=self.user)
+        response = Client().get(reverse('site_feed', args=['rss']))
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_writes_go_to_primary(self):
+        self.client.post(
+            reverse('add_comment', kwargs={
+                'username': 'Author', 'post_id': self.post.id}),
+            {'text': 'Комментарий'}
+        )
+        self.assertTrue(Comment.objects.using('default').exists())
+        self.assertFalse(Comment.objects.using('replica').exists())
+
+
+@override_settings(COMMENTS_PER_PAGE=10)
+class CommentPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Author')
+        self.post = Post.objects.create(text='Текст', author=self.user)
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user, text=f'Ответ {i}')
+            for i in range(25)
+        )
+        self.kwargs = {'username': 'Author', 'post_id': self.post.id}
+
+    def test_pages_cover_all_comments_once(self):
+        """Первая страница на странице поста, остальные — фрагментами."""
+        response = self.client.get(reverse('post', kwargs=self.kwargs))
+        page = response.context['comments']
+        seen = [comment.id for comment in page]
+        self.assertEqual(len(seen), 10)
+        while page.next_cursor:
+            response = self.client.get(
+                reverse('post_comments', kwargs=self.kwargs),
+                {'cursor': page.next_cursor}
+            )
+            self.assertTemplateUsed(response, 'includes/comment_list.html')
+            self.assertTemplateNotUsed(response, 'base.html')
+            page = response.context['comments']
+            seen += [comment.id for comment in page]
+        expected = self.post.comments.order_by('-created', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+
+    def test_new_comment_is_anchored(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('add_comment', kwargs=self.kwargs), {'text': 'Новый'}
+        )
+        comment = Comment.objects.get(text='Новый')
+        post_url = reverse('post', kwargs=self.kwargs)
+        self.assertRedirects(
+            response, f'{post_url}#comment_{comment.id}',
+            fetch_redirect_response=False
+        )
+        first_page = self.client.get(post_url).context['comments']
+        self.assertEqual(first_page[0], comment)
+
+
+class CoalescingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Author')
+        Post.objects.create(text='Первый пост', author=self.user)
+        self.key = coalescing.page_key(reverse('index'), '')
+
+    def delta(self, before):
+        after = coalescing.metrics()
+        return {name: after[name] - before[name] for name in after}
+
+    def test_expired_copy_while_other_request_rebuilds(self):
+        self.client.get(reverse('index'))
+        entry = cache.get(self.key)
+        entry['expires'] = 0
+        cache.set(self.key, entry)
+        cache.add(f'{self.key}:rebuild', 1)
+        before = coalescing.metrics()
+        self.assertEqual(self.client.get(reverse('index')).status_code, 200)
+        self.assertEqual(self.delta(before)['stale_served'], 1)
+        self.assertEqual(self.delta(before)['rebuilds_avoided'], 1)
+
+    @override_settings(COALESCE_WAIT=0.05, COALESCE_POLL=0.01)
+    def test_old_generation_is_not_served(self):
+        """Свой новый пост виден, даже пока страницу собирает другой."""
+        self.client.get(reverse('index'))
+        Post.objects.create(text='Второй пост', author=self.user)
+        cache.add(f'{self.key}:rebuild', 1)
+        before = coalescing.metrics()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Второй пост')
+        self.assertEqual(self.delta(before)['stale_served'], 0)
+        self.assertEqual(self.delta(before)['wait_timeouts'], 1)
+
+    @override_settings(COALESCE_WAIT=1, COALESCE_POLL=0.01)
+    def test_waits_for_rebuild_without_copy(self):
+        def built():
+            return HttpResponse('собрано')
+
+        cache.add(f'{self.key}:rebuild', 1)
+        timer = threading.Timer(0.05, coalescing.rebuild, args=[
+            self.key, 'g', built, 60
+        ])
+        timer.start()
+        before = coalescing.metrics()
+        response = coalescing.coalesce(self.key, 'g', self.fail, 60)
+        timer.join()
+        self.assertEqual(response.content.decode(), 'собрано')
+        self.assertEqual(self.delta(before)['waited'], 1)
+
+    @override_settings(COALESCE_BETA=10 ** 9)
+    def test_entry_is_refreshed_early(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return HttpResponse('страница')
+
+        coalescing.coalesce(self.key, 'g', build, 60)
+        before = coalescing.metrics()
+        coalescing.coalesce(self.key, 'g', build, 60)
+        self.assertEqual(len(builds), 2)
+        self.assertEqual(self.delta(before)['early_rebuilds'], 1)
+
+
+class FeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='Author', first_name='Лев', last_name='Толстой'
+        )
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(
+            text='Пост в группе', author=self.user, group=self.group
+        )
+        Post.objects.create(text='Пост без группы', author=self.user)
+
+    def read(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_feeds_list_posts(self):
+        feeds = {
+            reverse('site_feed', args=['atom']): 2,
+            reverse('group_feed', args=['group', 'rss']): 1,
+            reverse('author_feed', args=['Author', 'atom']): 2,
+        }
+        for url, count in feeds.items():
+            with self.subTest(url=url):
+                response, content = self.read(url)
+                self.assertEqual(
+                    content.count('<entry>') + content.count('<item>'), count
+                )
+                self.assertIn('Лев Толстой', content)
+                self.assertIn(reverse(
+                    'post', args=['Author', self.post.id]
+                ), content)
+        response, content = self.read(reverse('site_feed', args=['rss']))
+        self.assertEqual(response['Content-Type'].split(';')[0],
+                         'application/rss+xml')
+        self.assertIn('<category>Группа</category>', content)
+
+    @override_settings(FEED_SIZE=1)
+    def test_feed_is_bounded(self):
+        content = self.read(reverse('site_feed', args=['atom']))[1]
+        self.assertIn('Пост без группы', content)
+        self.assertNotIn('Пост в группе', content)
+
+    def test_unknown_feeds(self):
+        for url in (
+            reverse('group_feed', args=['missing', 'atom']),
+            reverse('author_feed', args=['missing', 'rss']),
+            '/feed/json/',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_feed_is_cached_until_posts_change(self):
+        url = reverse('group_feed', args=['group', 'atom'])
+        self.read(url)
+        with self.assertNumQueries(0):
+            content = self.read(url)[1]
+        self.assertIn('Пост в группе', content)
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        self.assertIn('Исправленный пост', self.read(url)[1])
+
+    def test_conditional_get(self):
+        url = reverse('author_feed', args=['Author', 'atom'])
+        etag = self.read(url)[0]['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(text='Новый пост', author=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_pages_link_feeds(self):
+        pages = {
+            reverse('index'): reverse('site_feed', args=['atom']),
+            reverse('group', args=['group']): reverse(
+                'group_feed', args=['group', 'rss']
+            ),
+            reverse('profile', args=['Author']): reverse(
+                'author_feed', args=['Author', 'atom']
+            ),
+        }
+        for page, feed in pages.items():
+            with self.subTest(page=page):
+                self.assertContains(self.client.get(page), f'href="{feed}"')
+
+
+@override_settings(SITEMAP_SEGMENT_SIZE=2)
+class SitemapTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='Author')
+        self.posts = [
+            Post.objects.create(text=f'Пост {i}', author=self.user)
+            for i in range(3)
+        ]
+
+    def segment(self, post):
+        return reverse('sitemap_segment', args=[post.pk // 2])
+
+    def test_index_lists_segments_by_id_range(self):
+        response = self.client.get(reverse('sitemap_index'))
+        self.assertEqual(response.status_code, 200)
+        for post in self.posts:
+            self.assertContains(response, self.segment(post))
+        newest = self.posts[-1].pk // 2
+        self.assertEqual(self.client.get(
+            reverse('sitemap_segment', args=[newest + 1])
+        ).status_code, 404)
+
+    def test_segment_lists_posts_with_lastmod(self):
+        post = self.posts[0]
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Комментарий'
+        )
+        Comment.objects.filter(pk=comment.pk).update(
+            created=post.pub_date + timedelta(days=1)
+        )
+        content = self.client.get(self.segment(post)).content.decode()
+        self.assertIn(
+            'http://testserver' + reverse('post', args=['Author', post.pk]),
+            content
+        )
+        lastmod = (post.pub_date + timedelta(days=1)).isoformat()
+        self.assertIn(f'<lastmod>{lastmod}</lastmod>', content)
+
+    def test_closed_segment_is_built_once(self):
+        for post in self.posts:
+            self.client.get(self.segment(post))
+        first = self.posts[0]
+        with self.assertNumQueries(1):
+            self.client.get(self.segment(first))
+        added = Post.objects.create(text='Новый пост', author=self.user)
+        for segment in SitemapSegment.objects.all():
+            with self.subTest(number=segment.number):
+                self.assertEqual(
+                    segment.is_fresh, segment.number != added.pk // 2
+                )
+        self.assertContains(
+            self.client.get(reverse('sitemap_index')), self.segment(added)
+        )
+        self.assertContains(
+            self.client.get(self.segment(added)),
+            reverse('post', args=['Author', added.pk])
+        )
+
+    def test_comment_marks_its_segment(self):
+        first = self.posts[0]
+        self.client.get(self.segment(first))
+        Comment.objects.create(post=first, author=self.user, text='Ок')
+        segment = SitemapSegment.objects.get(number=first.pk // 2)
+        self.assertFalse(segment.is_fresh)
+        self.client.get(self.segment(first))
+        segment.refresh_from_db()
+        self.assertTrue(segment.is_fresh)
@@ -0,0 +1,117 @@
+"""Фоновая подготовка миниатюр для картинок постов.
+
+После сохранения картинки миниатюры всех размеров из шаблонов строятся
+в пуле потоков, а не при первом показе страницы. Пока Post.thumbnail_ready
+не выставлен, карточка показывает исходную картинку.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from .caching import (author_stamp_key, bump_generations, post_scopes,
+                      touch_stamps)
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Размеры и параметры, с которыми {% thumbnail %} вызывается
+# в includes/post_item.html.
+GEOMETRIES = [
+    ('960x339', {'crop': 'center', 'upscale': True}),
+]
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails'
+        )
+    return _executor
+
+
+def thumbnail_key(image, geometry, options):
+    """Ключ KVStore, по которому get_thumbnail ищет готовую миниатюру.
+
+    Повторяет подготовку параметров из ThumbnailBackend.get_thumbnail,
+    не обращаясь к файлам.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return add_prefix(ImageFile(name, default.storage).key)
+
+
+def expect(posts):
+    """Готовит пакетное чтение миниатюр для карточек posts."""
+    kvstore = default.kvstore
+    if not hasattr(kvstore, 'expect'):
+        return
+    kvstore.expect(
+        thumbnail_key(post.image, geometry, options)
+        for post in posts if post.image and post.thumbnail_ready
+        for geometry, options in GEOMETRIES
+    )
+
+
+def schedule(post):
+    """Ставит картинку поста в очередь после commit транзакции."""
+    Post.objects.filter(pk=post.pk).update(thumbnail_ready=False)
+    post.thumbnail_ready = False
+    post_id = post.pk
+    if settings.THUMBNAIL_ASYNC:
+        transaction.on_commit(
+            lambda: get_executor().submit(generate_in_worker, post_id)
+        )
+    else:
+        transaction.on_commit(lambda: generate(post_id))
+
+
+def generate_in_worker(post_id):
+    # У потока пула своё соединение с базой: не держим его между задачами.
+    close_old_connections()
+    try:
+        generate(post_id)
+    finally:
+        close_old_connections()
+
+
+def generate(post_id):
+    try:
+        post = Post.objects.select_related('author', 'group').filter(
+            pk=post_id
+        ).first()
+        if post is None or not post.image:
+            return
+        for geometry, options in GEOMETRIES:
+            get_thumbnail(post.image, geometry, **options)
+        # Картинку могли заменить, пока строились миниатюры: тогда
+        # готовность отметит задача для новой картинки.
+        marked = Post.objects.filter(
+            pk=post_id, image=post.image.name
+        ).update(thumbnail_ready=True, version=F('version') + 1)
+        if marked:
+            bump_generations(*post_scopes(post))
+            touch_stamps(author_stamp_key(post.author_id))
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры поста %s', post_id)
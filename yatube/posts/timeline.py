@@ -0,0 +1,283 @@
+"""Материализованная лента подписок.
+
+Пост автора раскладывается в TimelineEntry каждого подписчика в момент
+публикации, поэтому чтение ленты не соединяет Follow с Post. Авторы,
+у которых подписчиков больше TIMELINE_FANOUT_LIMIT, не раскладываются:
+их посты подмешиваются в ленту при чтении. Когда такой автор опускается
+до порога, его посты, опубликованные без раскладки, раскладывает пачками
+команда resume_fan_out, а до тех пор автор читается как громкий.
+
+Ленты, переросшие TIMELINE_DEPTH с запасом TRIM_SLACK, подрезаются при
+записи в них.
+"""
+import heapq
+from functools import partial
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Q
+
+from . import writes
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import CursorPaginator
+
+BATCH_SIZE = 1000
+# Подписчиков на одну транзакцию раскладки resume_fan_out: это до
+# REFILL_BATCH × TIMELINE_DEPTH записей.
+REFILL_BATCH = 100
+# Ленты подрезаются, когда перерастают глубину на столько записей:
+# так подсчёт и удаление идут пачкой, а не ради каждой записи.
+TRIM_SLACK = 50
+
+
+def is_fanned_out(author):
+    stats = UserStats.for_user(author)
+    return stats.followers_count <= settings.TIMELINE_FANOUT_LIMIT
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты подписчиков автора."""
+    if not is_fanned_out(post.author):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True
+    ).iterator()
+    batch = []
+    for user_id in followers:
+        batch.append(user_id)
+        if len(batch) == BATCH_SIZE:
+            push(post, batch)
+            batch = []
+    if batch:
+        push(post, batch)
+
+
+def push(post, user_ids):
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in user_ids],
+        ignore_conflicts=True
+    )
+    cap(user_ids)
+
+
+def overgrown(user_ids=None):
+    """id пользователей, чьи ленты переросли TIMELINE_DEPTH с запасом."""
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    # Без order_by() сортировка из Meta попала бы в GROUP BY.
+    return entries.order_by().values('user_id').annotate(
+        size=Count('pk')
+    ).filter(
+        size__gt=settings.TIMELINE_DEPTH + TRIM_SLACK
+    ).values_list('user_id', flat=True)
+
+
+def cap(user_ids):
+    """Подрезает переросшие ленты пользователей user_ids."""
+    for user_id in overgrown(user_ids):
+        trim(user_id)
+
+
+def trim(user_id):
+    """Оставляет в ленте пользователя только TIMELINE_DEPTH записей."""
+    tail = TimelineEntry.objects.filter(user_id=user_id).values('pk')[
+        settings.TIMELINE_DEPTH:
+    ]
+    TimelineEntry.objects.filter(pk__in=tail).delete()
+
+
+def backfill(user, author):
+    """Добавляет в ленту последние посты автора после подписки."""
+    if not is_fanned_out(author):
+        return
+    recent = author.posts.order_by('-pub_date', '-id').values_list(
+        'pk', 'pub_date'
+    )[:settings.TIMELINE_DEPTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user=user, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in recent],
+        ignore_conflicts=True
+    )
+    trim(user.pk)
+
+
+def schedule_fan_out(author_id):
+    """Ставит в очередь раскладку автора, опустившегося до порога.
+
+    Вызывается после отписки, уменьшившей счётчик подписчиков: сама
+    раскладка — до TIMELINE_FANOUT_LIMIT × TIMELINE_DEPTH записей,
+    поэтому её делает команда resume_fan_out, а не запрос.
+    """
+    UserStats.objects.filter(
+        user_id=author_id, followers_count=settings.TIMELINE_FANOUT_LIMIT
+    ).update(pending_fan_outs=F('pending_fan_outs') + 1)
+
+
+def pending_fan_outs():
+    """id авторов, чья раскладка ждёт команды resume_fan_out."""
+    return UserStats.objects.filter(pending_fan_outs__gt=0).values_list(
+        'user_id', flat=True
+    )
+
+
+def refill(author_id, user_ids):
+    """Кладёт последние TIMELINE_DEPTH постов автора в ленты user_ids.
+
+    Подписка проверяется в той же вставке: отписавшемуся за время
+    раскладки посты не вернутся.
+    """
+    post = Post._meta.db_table
+    follow = Follow._meta.db_table
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR IGNORE INTO {TimelineEntry._meta.db_table} '
+            f'(user_id, post_id, pub_date) '
+            f'SELECT {follow}.user_id, recent.id, recent.pub_date '
+            f'FROM {follow}, '
+            f'(SELECT id, pub_date FROM {post} WHERE author_id = %s '
+            f'ORDER BY pub_date DESC, id DESC LIMIT %s) AS recent '
+            f'WHERE {follow}.author_id = %s '
+            f'AND {follow}.user_id IN ({placeholders})',
+            [author_id, settings.TIMELINE_DEPTH, author_id, *user_ids]
+        )
+    cap(user_ids)
+
+
+def resume_fan_out(author_id):
+    """Раскладывает посты автора подписчикам по REFILL_BATCH за транзакцию.
+
+    Пока раскладка не закончена, лента читает автора как громкого.
+    Если за это время автор снова опустился до порога, счётчик
+    останется больше нуля и раскладка повторится при следующем запуске.
+    """
+    requested = UserStats.objects.filter(user_id=author_id).values_list(
+        'pending_fan_outs', flat=True
+    ).first()
+    if not requested:
+        return
+    followers = Follow.objects.filter(author_id=author_id).order_by('pk')
+    last = 0
+    while True:
+        batch = list(followers.filter(pk__gt=last).values_list(
+            'pk', 'user_id'
+        )[:REFILL_BATCH])
+        if not batch:
+            break
+        last = batch[-1][0]
+        user_ids = [user_id for _, user_id in batch]
+        writes.write(partial(refill, author_id, user_ids))
+    UserStats.objects.filter(user_id=author_id).update(
+        pending_fan_outs=F('pending_fan_outs') - requested
+    )
+
+
+def drop(user_id, author_id):
+    """Убирает посты автора из ленты после отписки."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(user):
+    """Собирает ленту пользователя заново из его подписок.
+
+    Последние TIMELINE_DEPTH постов всех раскладываемых авторов
+    переносятся одним INSERT ... SELECT, без подписки за подпиской
+    и без объектов в Python.
+    """
+    TimelineEntry.objects.filter(user=user).delete()
+    authors = Follow.objects.filter(user=user).exclude(
+        author__stats__followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).values('author')
+    authors_sql, params = authors.query.sql_with_params()
+    post = Post._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TimelineEntry._meta.db_table} '
+            f'(user_id, post_id, pub_date) '
+            f'SELECT %s, id, pub_date FROM {post} '
+            f'WHERE author_id IN ({authors_sql}) '
+            f'ORDER BY pub_date DESC, id DESC LIMIT %s',
+            [user.pk, *params, settings.TIMELINE_DEPTH]
+        )
+
+
+def loud_authors(user):
+    """Авторы пользователя, чьи посты подмешиваются в ленту при чтении."""
+    return UserStats.objects.filter(
+        Q(followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+        | Q(pending_fan_outs__gt=0),
+        user__in=Follow.objects.filter(user=user).values('author'),
+    ).values_list('user_id', flat=True)
+
+
+def beyond(position, older, key, pk):
+    """Условие «за позицией (значение, id)» по полям key и pk."""
+    value, last = position
+    op = 'lt' if older else 'gt'
+    return Q(**{f'{key}__{op}': value}) | Q(
+        **{key: value, f'{pk}__{op}': last}
+    )
+
+
+class TimelinePaginator(CursorPaginator):
+    """Курсорные страницы ленты подписок пользователя user.
+
+    Позиции постов страницы читаются по индексам и без сортировки
+    в базе: из ленты пользователя по timeline_user_date_idx и из постов
+    каждого громкого автора отдельным запросом по post_author_date_idx,
+    каждая часть — не больше нужного числа строк. Части сливаются
+    в Python, а сами посты берутся из object_list по id.
+    """
+
+    def __init__(self, object_list, per_page, key='pub_date', *, user):
+        self.user = user
+        super().__init__(object_list, per_page)
+
+    def _positions(self, position, older, limit):
+        """Первые limit позиций (дата, id) ленты за position."""
+        def part(rows, pk):
+            if position is not None:
+                rows = rows.filter(beyond(position, older, 'pub_date', pk))
+            order = ['pub_date', pk]
+            if older:
+                order = [f'-{field}' for field in order]
+            return rows.order_by(*order).values_list('pub_date', pk)[:limit]
+
+        parts = [
+            part(TimelineEntry.objects.filter(user=self.user), 'post_id')
+        ] + [
+            part(Post.objects.filter(author_id=author_id), 'id')
+            for author_id in loud_authors(self.user)
+        ]
+        positions = []
+        seen = set()
+        merged = heapq.merge(*parts, reverse=older)
+        for pub_date, pk in merged:
+            # Пост громкого автора мог остаться в ленте с тех пор,
+            # когда он ещё раскладывался.
+            if pk not in seen:
+                seen.add(pk)
+                positions.append((pub_date, pk))
+                if len(positions) == limit:
+                    break
+        return positions
+
+    def _rows(self, position=None, older=True):
+        ids = [pk for _, pk in self._positions(
+            position, older, self.per_page + 1
+        )]
+        if not ids:
+            return []
+        rows = {
+            self._position(row)[1]: row
+            for row in self.object_list.order_by().filter(pk__in=ids)
+        }
+        return [rows[pk] for pk in ids if pk in rows]
+
+    def _anchor(self, offset):
+        positions = self._positions(None, True, offset + 1)
+        return positions[offset] if len(positions) > offset else None
@@ -1,14 +1,35 @@
-from django.urls import path
+from django.urls import path, register_converter
 
-from . import views
+from . import feeds, sitemaps, views
+
+register_converter(feeds.FeedFormatConverter, 'feed')
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('feed/<feed:feed_format>/', feeds.site_feed, name='site_feed'),
     path('group/<slug:slug>/', views.group_posts, name='group'),
+    path(
+        'group/<slug:slug>/feed/<feed:feed_format>/',
+        feeds.group_feed,
+        name='group_feed'),
     path('new/', views.new_post, name='new_post'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search, name='search'),
+    path('sitemap.xml', sitemaps.sitemap_index, name='sitemap_index'),
+    path(
+        'sitemap-<int:number>.xml',
+        sitemaps.sitemap_segment,
+        name='sitemap_segment'),
     path('<str:username>/', views.profile, name='profile'),
+    path(
+        '<str:username>/feed/<feed:feed_format>/',
+        feeds.author_feed,
+        name='author_feed'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
+    path(
+        '<str:username>/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'),
     path(
         '<str:username>/<int:post_id>/edit/',
         views.post_edit,
@@ -1,83 +1,116 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
-
+from django.urls import reverse
+from django.views.decorators.http import condition
+
+from . import thumbnails, timeline, writes
+from .budgets import query_budget
+from .caching import (cache_follow_feed, cache_generational,
+                      generation_etag, group_scope, index_scope, post_etag,
+                      profile_scope)
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Follow, Group, Post, User, UserStats
+from .paginators import CursorPaginator, legacy_page_redirect
+from .search import get_backend
 
 
-@cache_page(20, key_prefix='index_page')
+@query_budget(3)
+@cache_generational(index_scope)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, settings.NUMBER_OF_BLOCKS)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.select_related('author', 'group')
+    paginator = CursorPaginator(post_list, settings.NUMBER_OF_BLOCKS)
+    if 'page' in request.GET:
+        return legacy_page_redirect(request, paginator)
+    page = paginator.get_page(request.GET.get('cursor'))
+    thumbnails.expect(page)
     return render(request, 'index.html', {'page': page})
 
 
+@query_budget(4)
+@condition(etag_func=generation_etag(group_scope))
+@cache_generational(group_scope)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, settings.NUMBER_OF_BLOCKS)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = group.posts.select_related('author')
+    paginator = CursorPaginator(post_list, settings.NUMBER_OF_BLOCKS)
+    if 'page' in request.GET:
+        return legacy_page_redirect(request, paginator)
+    page = paginator.get_page(request.GET.get('cursor'))
+    thumbnails.expect(page)
     return render(
         request,
         'group.html',
         {'group': group, 'page': page, })
 
 
+@query_budget(6)
+@condition(etag_func=generation_etag(profile_scope))
+@cache_generational(profile_scope)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, settings.NUMBER_OF_BLOCKS)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = author.posts.select_related('group')
+    paginator = CursorPaginator(post_list, settings.NUMBER_OF_BLOCKS)
+    if 'page' in request.GET:
+        return legacy_page_redirect(request, paginator)
+    page = paginator.get_page(request.GET.get('cursor'))
+    thumbnails.expect(page)
     following = author.following.filter(user__id=request.user.id).exists()
-    followers_statics = {
-        'followers_count': author.following.all().count(),
-        'follows_count': author.follower.all().count(),
-    }
     return render(request, 'profile.html', {
         'author': author,
         'page': page,
         'following': following,
-        'followers_statics': followers_statics,
+        'stats': UserStats.for_user(author),
     })
 
 
+def comments_page(request, post):
+    """Страница комментариев поста по курсору из ?cursor=."""
+    paginator = CursorPaginator(
+        post.comments.select_related('author'),
+        settings.COMMENTS_PER_PAGE,
+        key='created'
+    )
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+@query_budget(6)
+@condition(etag_func=post_etag)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'),
+        id=post_id, author__username=username
+    )
     author = post.author
-    followers_statics = {
-        'followers_count': author.following.all().count(),
-        'follows_count': author.follower.all().count(),
-    }
-    comments = post.comments.all()
+    comments = comments_page(request, post)
     form = CommentForm(request.POST or None)
+    thumbnails.expect([post])
     return render(request, 'post.html', {
         'form': form,
         'author': author,
         'post': post,
         'comments': comments,
-        'followers_statics': followers_statics,
+        'stats': UserStats.for_user(author),
         'add_comment': False
     })
 
 
+@query_budget(3)
 @login_required
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
-        return redirect('index')
-    return render(request, 'edit.html', {'form': form})
+        if writes.save(form, post):
+            return redirect('index')
+    return render(
+        request, 'edit.html', {'form': form}, status=writes.status(form)
+    )
 
 
+@query_budget(5)
 @login_required
 def post_edit(request, post_id, username):
     post = get_object_or_404(Post, id=post_id, author__username=username)
@@ -88,60 +121,121 @@ def post_edit(request, post_id, username):
             files=request.FILES or None,
             instance=post
         )
-        if form.is_valid():
-            post.save()
+        if form.is_valid() and writes.save(form, post):
             return redirect('post', request.user, post.id)
         return render(
             request, 'edit.html',
-            {'form': form, 'post': post, 'edit': True})
+            {'form': form, 'post': post, 'edit': True},
+            status=writes.status(form))
     return redirect('post', author, post.id)
 
 
+@query_budget(5)
 @login_required
 def add_comment(request, post_id, username):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'),
+        id=post_id, author__username=username
+    )
     author = post.author
-    comments = post.comments.all()
+    comments = comments_page(request, post)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.post = post
         comment.author = request.user
-        comment.save()
-        return redirect('post', author, post.id)
+        if writes.save(form, comment):
+            # Новый комментарий — первый на первой странице, к нему
+            # и переходим.
+            url = reverse('post', args=[author, post.id])
+            return redirect(f'{url}#comment_{comment.id}')
+    thumbnails.expect([post])
     return render(request, 'post.html', {
         'form': form,
         'author': author,
         'post': post,
         'comments': comments,
+        'stats': UserStats.for_user(author),
         'add_comment': True
+    }, status=writes.status(form))
+
+
+@query_budget(5)
+@condition(etag_func=post_etag)
+def post_comments(request, username, post_id):
+    """Следующая страница комментариев — фрагмент HTML для подгрузки."""
+    post = get_object_or_404(
+        Post.objects.select_related('author'),
+        id=post_id, author__username=username
+    )
+    return render(request, 'includes/comment_list.html', {
+        'author': post.author,
+        'post': post,
+        'comments': comments_page(request, post),
     })
 
 
+@query_budget(4)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    hits = []
+    if query:
+        hits = get_backend().search(query, settings.SEARCH_RESULTS_LIMIT)
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        {hit.post_id for hit in hits}
+    )
+    results = [
+        {'post': posts[hit.post_id], 'hit': hit}
+        for hit in hits if hit.post_id in posts
+    ]
+    thumbnails.expect(posts.values())
+    return render(request, 'search.html', {
+        'query': query,
+        'results': results,
+    })
+
+
+# И ещё по запросу на каждого громкого автора в подписках.
+@query_budget(6)
 @login_required
+@cache_follow_feed
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, settings.NUMBER_OF_BLOCKS)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator = timeline.TimelinePaginator(
+        Post.objects.select_related('author', 'group'),
+        settings.NUMBER_OF_BLOCKS,
+        user=request.user
+    )
+    if 'page' in request.GET:
+        return legacy_page_redirect(request, paginator)
+    page = paginator.get_page(request.GET.get('cursor'))
+    thumbnails.expect(page)
     return render(request, "follow.html", {'page': page, })
 
 
+@query_budget(6)
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if username != request.user.username:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        with transaction.atomic():
+            Follow.objects.get_or_create(user=request.user, author=author)
     return redirect('profile', username)
 
 
+@query_budget(11)
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    Follow.objects.filter(author=author, user=request.user).delete()
+    with transaction.atomic():
+        follows = Follow.objects.filter(author=author, user=request.user)
+        for follow in follows:
+            # Сигналам нужны имена обоих: отдаём уже загруженных.
+            follow.user, follow.author = request.user, author
+            follow.delete()
     return redirect('profile', username)
 
 
+@query_budget(0)
 def page_not_found(request, exception):
     return render(
         request,
@@ -151,5 +245,6 @@ def page_not_found(request, exception):
     )
 
 
+@query_budget(0)
 def server_error(request):
     return render(request, "misc/500.html", status=500)
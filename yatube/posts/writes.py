@@ -0,0 +1,77 @@
+"""Очередь записи для view, которые публикуют посты и комментарии.
+
+SQLite пускает одного писателя за раз. Транзакции записи процесса
+выстраиваются в очередь на блокировке и идут по одной, поэтому потоки
+не отнимают друг у друга блокировку базы. Если базу держит другой
+процесс дольше busy_timeout, транзакция повторяется с растущей паузой;
+когда не помогли и повторы, view показывает форму с ошибкой и кодом 503
+вместо страницы 500, и введённый текст не теряется.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import OperationalError, connection, transaction
+
+BUSY_MESSAGE = 'Сайт сейчас перегружен, попробуйте отправить ещё раз.'
+
+_queue = threading.Lock()
+
+
+class WriteBusy(Exception):
+    pass
+
+
+def is_locked(error):
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def write(function):
+    """Выполняет function в транзакции через очередь, с повторами.
+
+    Внутри чужой транзакции повторять бесполезно: её снимок уже устарел,
+    поэтому там function выполняется сразу.
+    """
+    if connection.in_atomic_block:
+        return function()
+    for attempt in range(settings.WRITE_RETRIES + 1):
+        if not _queue.acquire(timeout=settings.WRITE_QUEUE_TIMEOUT):
+            raise WriteBusy
+        try:
+            with transaction.atomic():
+                return function()
+        except OperationalError as error:
+            if not is_locked(error):
+                raise
+        finally:
+            _queue.release()
+        # Случайная добавка разводит процессы, упёршиеся друг в друга.
+        time.sleep(
+            settings.WRITE_RETRY_DELAY * 2 ** attempt * random.uniform(1, 2)
+        )
+    raise WriteBusy
+
+
+def save(form, instance):
+    """Сохраняет instance через очередь; при перегрузке — ошибка формы."""
+    pk, adding = instance.pk, instance._state.adding
+
+    def attempt():
+        # Неудачная попытка могла успеть выдать объекту id.
+        instance.pk, instance._state.adding = pk, adding
+        instance.save()
+
+    try:
+        write(attempt)
+    except WriteBusy:
+        form.add_error(None, ValidationError(BUSY_MESSAGE, code='busy'))
+        return False
+    return True
+
+
+def status(form):
+    """Код ответа для формы: 503, если запись не прошла из-за нагрузки."""
+    return 503 if form.has_error(NON_FIELD_ERRORS, 'busy') else 200
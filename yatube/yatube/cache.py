@@ -0,0 +1,508 @@
+"""Двухуровневый кэш: LRU в памяти процесса перед общим хранилищем.
+
+TieredCache держит в процессе небольшой LRU (L1) и читает промахи из
+общего для всех воркеров кэша L2 — любого другого алиаса CACHES:
+SQLiteCache из этого модуля, memcached или redis. Записи идут в оба
+уровня.
+
+Чтобы процессы не отдавали из L1 значения, изменённые соседом, каждая
+запись увеличивает в L2 счётчик-штамп и кладёт в журнал ключ под его
+номером. Процесс сверяет свой штамп с общим в начале каждого запроса
+(а вне запросов — не реже SYNC_INTERVAL секунд) и выбрасывает из L1
+ключи из журнала. clear() меняет эпоху — тогда L1 очищается целиком,
+как и при пропуске в журнале. Значения, пришедшие из L2, живут в L1 не
+дольше L1_TIMEOUT: срок их жизни в L2 процессу неизвестен.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.signals import request_started
+
+STAMP_KEY = 'tiered:stamp'
+EPOCH_KEY = 'tiered:epoch'
+LOG_KEY = 'tiered:log:{}'
+
+_missing = object()
+_stores = {}
+_stores_lock = threading.Lock()
+_counters = {}
+
+
+def counters(name):
+    """Счётчики процесса: экземпляры кэша у каждого потока свои."""
+    with _stores_lock:
+        return _counters.setdefault(name, Counter())
+
+
+class LocalStore:
+    """L1 одного процесса: общий для потоков LRU из сериализованных значений.
+
+    Значения хранятся в pickle, как в LocMemCache: закэшированный ответ
+    не должен меняться оттого, что его правит текущий запрос.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.counters = Counter()
+        self.stamp = 0
+        self.epoch = None
+        self.synced = 0.0
+        self.own = set()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None:
+                expires, data = entry
+                if expires is None or expires > time.time():
+                    self.data.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return data
+                del self.data[key]
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, key, data, expires):
+        with self.lock:
+            self.data[key] = (expires, data)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def reset(self, stamp, epoch):
+        with self.lock:
+            self.data.clear()
+            self.own.clear()
+            self.stamp, self.epoch = stamp, epoch
+            self.counters['resets'] += 1
+
+    def advance(self, stamp, keys):
+        with self.lock:
+            if stamp <= self.stamp:
+                return
+            for key in keys:
+                if self.data.pop(key, None) is not None:
+                    self.counters['invalidations'] += 1
+            self.own = {seq for seq in self.own if seq > stamp}
+            self.stamp = stamp
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = options['L2']
+        self.l1_timeout = options.get('L1_TIMEOUT', 60)
+        self.sync_interval = options.get('SYNC_INTERVAL', 1)
+        self.log_timeout = options.get('LOG_TIMEOUT', 600)
+        self.log_window = options.get('LOG_WINDOW', 1000)
+        with _stores_lock:
+            self.store = _stores.setdefault(
+                location or 'default', LocalStore(self._max_entries)
+            )
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def fetched_expires(self):
+        return time.time() + self.l1_timeout
+
+    def remember(self, key, value, expires):
+        self.store.put(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                       expires)
+
+    def maybe_sync(self):
+        if time.monotonic() - self.store.synced > self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """Выбрасывает из L1 ключи, изменённые другими процессами."""
+        store = self.store
+        store.synced = time.monotonic()
+        found = self.l2.get_many([STAMP_KEY, EPOCH_KEY])
+        stamp, epoch = found.get(STAMP_KEY, 0), found.get(EPOCH_KEY)
+        if (epoch != store.epoch or stamp < store.stamp
+                or stamp - store.stamp > self.log_window):
+            store.reset(stamp, epoch)
+            return
+        seqs = [
+            seq for seq in range(store.stamp + 1, stamp + 1)
+            if seq not in store.own
+        ]
+        log = self.l2.get_many([LOG_KEY.format(seq) for seq in seqs])
+        if len(log) < len(seqs):
+            # Запись журнала вытеснена или ещё не дописана: какие ключи
+            # устарели, неизвестно.
+            store.reset(stamp, epoch)
+            return
+        store.advance(stamp, log.values())
+
+    def publish(self, keys):
+        """Сообщает другим процессам, что ключи L1 keys изменились."""
+        l2 = self.l2
+        try:
+            last = l2.incr(STAMP_KEY, len(keys))
+        except ValueError:
+            l2.add(STAMP_KEY, 0, None)
+            last = l2.incr(STAMP_KEY, len(keys))
+        seqs = range(last - len(keys) + 1, last + 1)
+        with self.store.lock:
+            self.store.own.update(seqs)
+        l2.set_many({
+            LOG_KEY.format(seq): key for seq, key in zip(seqs, keys)
+        }, self.log_timeout)
+
+    def get(self, key, default=None, version=None):
+        self.maybe_sync()
+        l1_key = self.make_key(key, version=version)
+        self.validate_key(l1_key)
+        data = self.store.get(l1_key)
+        if data is not None:
+            return pickle.loads(data)
+        value = self.l2.get(key, _missing, version=version)
+        if value is _missing:
+            self.store.counters['l2_misses'] += 1
+            return default
+        self.store.counters['l2_hits'] += 1
+        self.remember(l1_key, value, self.fetched_expires())
+        return value
+
+    def get_many(self, keys, version=None):
+        self.maybe_sync()
+        found, missing = {}, []
+        for key in keys:
+            data = self.store.get(self.make_key(key, version=version))
+            if data is None:
+                missing.append(key)
+            else:
+                found[key] = pickle.loads(data)
+        if missing:
+            fetched = self.l2.get_many(missing, version=version)
+            self.store.counters['l2_hits'] += len(fetched)
+            self.store.counters['l2_misses'] += len(missing) - len(fetched)
+            expires = self.fetched_expires()
+            for key, value in fetched.items():
+                self.remember(self.make_key(key, version=version), value,
+                              expires)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        l1_key = self.make_key(key, version=version)
+        self.validate_key(l1_key)
+        self.l2.set(key, value, timeout, version=version)
+        self.remember(l1_key, value, self.get_backend_timeout(timeout))
+        self.publish([l1_key])
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        l1_key = self.make_key(key, version=version)
+        self.validate_key(l1_key)
+        if not self.l2.add(key, value, timeout, version=version):
+            return False
+        self.remember(l1_key, value, self.get_backend_timeout(timeout))
+        self.publish([l1_key])
+        return True
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        failed = self.l2.set_many(data, timeout, version=version) or []
+        expires = self.get_backend_timeout(timeout)
+        keys = []
+        for key, value in data.items():
+            if key not in failed:
+                keys.append(self.make_key(key, version=version))
+                self.remember(keys[-1], value, expires)
+        if keys:
+            self.publish(keys)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        # Значение не меняется, поэтому соседей не оповещаем: их копия
+        # просто перечитается из L2, когда истечёт.
+        self.store.discard([self.make_key(key, version=version)])
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        l1_key = self.make_key(key, version=version)
+        self.remember(l1_key, value, self.fetched_expires())
+        self.publish([l1_key])
+        return value
+
+    def delete(self, key, version=None):
+        l1_key = self.make_key(key, version=version)
+        self.store.discard([l1_key])
+        self.l2.delete(key, version=version)
+        self.publish([l1_key])
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return
+        l1_keys = [self.make_key(key, version=version) for key in keys]
+        self.store.discard(l1_keys)
+        self.l2.delete_many(keys, version=version)
+        self.publish(l1_keys)
+
+    def clear(self):
+        self.l2.clear()
+        epoch = uuid.uuid4().hex
+        self.l2.set(EPOCH_KEY, epoch, None)
+        self.store.reset(0, epoch)
+
+    def stats(self):
+        store = self.store
+        with store.lock:
+            snapshot = dict(store.counters, entries=len(store.data))
+        l2 = {
+            'hits': snapshot.pop('l2_hits', 0),
+            'misses': snapshot.pop('l2_misses', 0),
+        }
+        if hasattr(self.l2, 'stats'):
+            l2['evictions'] = self.l2.stats().get('evictions', 0)
+        l1 = {name: snapshot.get(name, 0) for name in (
+            'entries', 'hits', 'misses', 'evictions', 'invalidations',
+            'resets',
+        )}
+        return {'l1': l1, 'l2': l2}
+
+
+def sync_tiered_caches(**kwargs):
+    """В начале запроса L1 каждого TieredCache сверяется с L2."""
+    path = f'{__name__}.{TieredCache.__name__}'
+    for alias, params in settings.CACHES.items():
+        if params['BACKEND'] == path:
+            caches[alias].sync()
+
+
+request_started.connect(sync_tiered_caches)
+
+
+class SQLiteCache(BaseCache):
+    """Общий для процессов кэш в отдельном файле SQLite.
+
+    Работает без внешних сервисов. При переполнении вытесняются записи,
+    срок которых истекает раньше всех, а не случайные, как у
+    FileBasedCache; проверка размера идёт раз в CULL_EVERY записей,
+    а не на каждой.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.table = options.get('TABLE', 'cache')
+        self.cull_every = options.get('CULL_EVERY', 100)
+        self.counters = counters(f'{location}:{self.table}')
+        self.writes = 0
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None,
+                check_same_thread=False
+            )
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            db.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                f'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL'
+                f') WITHOUT ROWID'
+            )
+            db.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.table}_expires '
+                f'ON {self.table} (expires)'
+            )
+            self._db = db
+        return self._db
+
+    def key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def alive(self, expires):
+        return expires is None or expires > time.time()
+
+    def get(self, key, default=None, version=None):
+        row = self.db.execute(
+            f'SELECT value, expires FROM {self.table} WHERE key = ?',
+            [self.key(key, version)]
+        ).fetchone()
+        if row is None or not self.alive(row[1]):
+            self.counters['misses'] += 1
+            return default
+        self.counters['hits'] += 1
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        names = {self.key(key, version): key for key in keys}
+        found = {}
+        made = list(names)
+        # Не больше 500 параметров: предел SQLite на старых сборках.
+        for start in range(0, len(made), 500):
+            chunk = made[start:start + 500]
+            rows = self.db.execute(
+                f'SELECT key, value, expires FROM {self.table} '
+                f'WHERE key IN ({", ".join("?" * len(chunk))})', chunk
+            )
+            for made_key, value, expires in rows:
+                if self.alive(expires):
+                    found[names[made_key]] = pickle.loads(value)
+        self.counters['hits'] += len(found)
+        self.counters['misses'] += len(names) - len(found)
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def upsert(self, rows, only_expired=False):
+        condition = (
+            f' WHERE {self.table}.expires IS NOT NULL'
+            f' AND {self.table}.expires <= {time.time()!r}'
+            if only_expired else ''
+        )
+        cursor = self.db.executemany(
+            f'INSERT INTO {self.table} (key, value, expires) '
+            f'VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+            f'value = excluded.value, expires = excluded.expires'
+            + condition, rows
+        )
+        self.writes += len(rows)
+        if self.writes >= self.cull_every:
+            self.writes = 0
+            self.cull()
+        return cursor.rowcount
+
+    def row(self, key, value, timeout, version):
+        return (
+            self.key(key, version),
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            self.get_backend_timeout(timeout),
+        )
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.upsert([self.row(key, value, timeout, version)])
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        row = self.row(key, value, timeout, version)
+        return self.upsert([row], only_expired=True) > 0
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        rows = [
+            self.row(key, value, timeout, version)
+            for key, value in data.items()
+        ]
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.upsert(rows)
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self.db.execute(
+            f'UPDATE {self.table} SET expires = ? WHERE key = ? '
+            f'AND (expires IS NULL OR expires > ?)',
+            [self.get_backend_timeout(timeout), self.key(key, version),
+             time.time()]
+        )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        made_key = self.key(key, version)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.db.execute(
+                f'SELECT value, expires FROM {self.table} WHERE key = ?',
+                [made_key]
+            ).fetchone()
+            if row is None or not self.alive(row[1]):
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            self.db.execute(
+                f'UPDATE {self.table} SET value = ? WHERE key = ?',
+                [pickle.dumps(value, pickle.HIGHEST_PROTOCOL), made_key]
+            )
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        return value
+
+    def delete(self, key, version=None):
+        cursor = self.db.execute(
+            f'DELETE FROM {self.table} WHERE key = ?', [self.key(key, version)]
+        )
+        return cursor.rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        made = [self.key(key, version) for key in keys]
+        for start in range(0, len(made), 500):
+            chunk = made[start:start + 500]
+            self.db.execute(
+                f'DELETE FROM {self.table} '
+                f'WHERE key IN ({", ".join("?" * len(chunk))})', chunk
+            )
+
+    def clear(self):
+        self.db.execute(f'DELETE FROM {self.table}')
+
+    def cull(self):
+        """Удаляет истёкшие записи, а при переполнении — ближайшие к сроку."""
+        self.db.execute(
+            f'DELETE FROM {self.table} WHERE expires <= ?', [time.time()]
+        )
+        count, = self.db.execute(
+            f'SELECT COUNT(*) FROM {self.table}'
+        ).fetchone()
+        if count <= self._max_entries:
+            return
+        # Как и в кэшах Django, удаляется с запасом — 1/CULL_FREQUENCY.
+        excess = count
+        if self._cull_frequency:
+            excess -= self._max_entries - (
+                self._max_entries // self._cull_frequency
+            )
+        cursor = self.db.execute(
+            f'DELETE FROM {self.table} WHERE key IN ('
+            f'SELECT key FROM {self.table} '
+            f'ORDER BY expires IS NULL, expires LIMIT ?)', [excess]
+        )
+        self.counters['evictions'] += cursor.rowcount
+
+    def stats(self):
+        return {
+            name: self.counters[name]
+            for name in ('hits', 'misses', 'evictions')
+        }
@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -45,17 +49,21 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'posts',
     'about',
+    'api',
     'sorl.thumbnail',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'posts.routers.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # последней, чтобы время view не включало остальные middleware
+    'posts.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -86,11 +94,51 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # sqlite3 с прагмами на каждом соединении (yatube/sqlite/base.py)
+        'ENGINE': 'yatube.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # соединение переживает запрос, прагмы и кэш страниц не теряются
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            # транзакция сразу берёт блокировку записи и ждёт её
+            # по busy_timeout, а не падает на первом INSERT
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                # читатели не ждут писателя и наоборот
+                'journal_mode': 'WAL',
+                # в WAL fsync при checkpoint, а не на каждый коммит
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+                'mmap_size': 256 * 1024 * 1024,
+                # отрицательное значение — в КиБ, то есть 64 МиБ
+                'cache_size': -64 * 1024,
+                'temp_store': 'MEMORY',
+            },
+        },
     }
 }
 
+# Реплики для чтения из DATABASES, см. posts.routers. Локально реплика —
+# копия файла базы, которую обновляет manage.py sync_replicas:
+# DATABASES['replica'] = {
+#     **DATABASES['default'],
+#     'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+#     'TEST': {'MIRROR': 'default'},
+# }
+# DATABASE_REPLICAS = ['replica']
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['posts.routers.PrimaryReplicaRouter']
+# Сколько реплика может отставать: столько после своей записи
+# пользователь читает основную базу и столько живут в кэше страницы,
+# собранные с реплики
+REPLICA_LAG = 10
+
+# Запись из view идёт через очередь posts.writes: по одной транзакции
+# в процессе, при database is locked — повтор с растущей паузой
+WRITE_QUEUE_TIMEOUT = 10
+WRITE_RETRIES = 4
+WRITE_RETRY_DELAY = 0.05
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -136,6 +184,15 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# загрузки больше этого размера пишутся во временный файл, а не в память
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+
+# ограничения и нормализация картинок постов при загрузке
+POST_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 50 * 1000 * 1000
+POST_IMAGE_MAX_SIDE = 2048
+POST_IMAGE_JPEG_QUALITY = 85
+
 # Login
 
 LOGIN_URL = '/auth/login/'
@@ -148,9 +205,94 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 NUMBER_OF_BLOCKS = 10
+# комментариев на странице поста, остальные подгружаются по курсору
+COMMENTS_PER_PAGE = 20
+
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
+# Тесты (manage.py test и pytest) пишут общий кэш во временный каталог:
+# иначе cache.clear() в них стирал бы кэш разработчика, а записи и номера
+# поколений прошлых прогонов влияли бы на следующий
+CACHE_DIR = BASE_DIR
+if TESTING:
+    CACHE_DIR = tempfile.mkdtemp(prefix='yatube-cache-')
+    atexit.register(shutil.rmtree, CACHE_DIR, True)
 
 CACHES = {
+    # Небольшой LRU в памяти процесса перед общим для всех воркеров
+    # кэшем; соседи узнают об изменениях по штампам (yatube/cache.py)
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'yatube.cache.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {'L2': 'shared', 'MAX_ENTRIES': 1000},
+    },
+    # Общий уровень — файл SQLite; для memcached или redis достаточно
+    # поменять здесь BACKEND и LOCATION
+    'shared': {
+        'BACKEND': 'yatube.cache.SQLiteCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Метаданные миниатюр отдельно от страниц: их не должен вытеснять
+    # поток кэшируемых лент
+    'thumbnails': {
+        'BACKEND': 'yatube.cache.TieredCache',
+        'LOCATION': 'thumbnails',
+        'TIMEOUT': None,
+        'OPTIONS': {'L2': 'thumbnails_shared', 'MAX_ENTRIES': 20000},
+    },
+    'thumbnails_shared': {
+        'BACKEND': 'yatube.cache.SQLiteCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'cache.sqlite3'),
+        'TIMEOUT': None,
+        'OPTIONS': {'TABLE': 'thumbnails', 'MAX_ENTRIES': 200000},
+    },
 }
+
+# Лента подписок: сколько последних постов хранится у подписчика и
+# начиная с какого числа подписчиков посты автора не раскладываются
+# по лентам, а подмешиваются при чтении
+TIMELINE_DEPTH = 800
+TIMELINE_FANOUT_LIMIT = 10000
+
+# Страницы лент хранятся в кэше часами: устаревшие сбрасываются сменой
+# поколения при записи, а не по таймауту
+PAGE_CACHE_TIMEOUT = 60 * 60 * 4
+# Номера поколений живут дольше страниц, но не вечно: истёкший номер
+# заводится заново от текущего времени
+GENERATION_TIMEOUT = 60 * 60 * 24
+# Пересборка страниц одним запросом (posts.coalescing): сколько ждать
+# чужой сборки, срок её блокировки, сколько после срока отдавать
+# устаревшую копию и насколько рано пересобирать заранее
+COALESCE_WAIT = 2
+COALESCE_POLL = 0.05
+COALESCE_LOCK_TIMEOUT = 30
+COALESCE_STALE = 60
+COALESCE_BETA = 1.0
+FOLLOW_FEED_CACHE_TIMEOUT = 60 * 60
+# Постов в одной части карты сайта; часть — диапазон id постов
+SITEMAP_SEGMENT_SIZE = 5000
+# Постов в Atom и RSS лентах сайта, сообщества и автора
+FEED_SIZE = 20
+
+# JSON API: размер страницы по умолчанию и наибольший для ?limit=
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+# Разбивка времени запросов в Server-Timing и гистограммы маршрутов
+# на /admin/request-stats/; выключенная middleware ничего не стоит
+REQUEST_PROFILING = False
+
+SEARCH_BACKEND = 'posts.search.SQLiteFTSBackend'
+SEARCH_RESULTS_LIMIT = 50
+ADMIN_SEARCH_LIMIT = 1000
+
+# Миниатюры картинок строятся в фоне после сохранения поста. В тестах —
+# сразу: база в памяти с общим кэшем SQLite блокирует таблицу целиком,
+# и чтение из потока пула роняло запись теста с «table is locked»
+THUMBNAIL_ASYNC = not TESTING
+THUMBNAIL_WORKERS = 2
+# Метаданные миниатюр хранятся в общей таблице sorl в базе, поверх неё —
+# кэш thumbnails; страницы читают их пакетом (posts.kvstore)
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'
+THUMBNAIL_CACHE = 'thumbnails'
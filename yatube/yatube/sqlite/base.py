@@ -0,0 +1,31 @@
+"""SQLite с прагмами на каждом соединении.
+
+Стандартный backend передаёт OPTIONS прямо в sqlite3.connect, поэтому
+прагмы (journal_mode, synchronous, busy_timeout, mmap_size, cache_size)
+нельзя задать в настройках. Этот backend забирает из OPTIONS словарь
+pragmas и выполняет его сразу после открытия соединения, а
+transaction_mode задаёт вид BEGIN у transaction.atomic: с IMMEDIATE
+транзакция берёт блокировку записи сразу и ждёт её по busy_timeout,
+а не падает с database is locked на первом INSERT.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute(f'BEGIN {self.transaction_mode}')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -19,6 +19,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from posts.profiling import request_stats
+
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
@@ -31,8 +33,12 @@ urlpatterns = [
     path('auth/', include('django.contrib.auth.urls')),
 
     # раздел администратора
+    path('admin/request-stats/', request_stats, name='request_stats'),
     path('admin/', admin.site.urls),
 
+    # JSON API, версия в адресе
+    path('api/v1/', include('api.urls', namespace='api')),
+
     # обработчик для главной страницы ищем в urls.py приложения posts
     path("", include('posts.urls')),
     path('about/', include('about.urls', namespace='about')),